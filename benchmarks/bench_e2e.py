@@ -0,0 +1,253 @@
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import platform
+import tracemalloc
+import contextlib
+from types import SimpleNamespace
+from typing import Dict, List
+
+# Offline end-to-end benchmark: search -> fetch -> parse -> cache -> generate against local stand-ins.
+# Usage:
+#   python benchmarks/bench_e2e.py --output results.json
+#   python benchmarks/bench_e2e.py --baseline baseline.json --tolerance 0.25   (exit 1 on regression)
+
+# Caches live in a throwaway directory, configured before the app modules read their settings
+_workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+os.environ.setdefault("PAGE_CACHE_PATH", os.path.join(_workdir, "pages.sqlite3"))
+os.environ.setdefault("HOST_SCORES_PATH", os.path.join(_workdir, "hosts.sqlite3"))
+os.environ.setdefault("PASSAGE_INDEX_PATH", os.path.join(_workdir, "index"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import httpx
+import offline
+import websearch
+import page_cache
+import host_scores
+import passage_index
+import search_cache
+import cache_registry
+
+SCENARIOS = [
+    {"name": "topk3-cold", "topk": 3, "warm": False, "sessions": 1},
+    {"name": "topk3-warm", "topk": 3, "warm": True, "sessions": 1},
+    {"name": "topk10-cold", "topk": 10, "warm": False, "sessions": 1},
+    {"name": "topk10-warm", "topk": 10, "warm": True, "sessions": 1},
+    {"name": "sessions8-warm", "topk": 3, "warm": True, "sessions": 8},
+    # Long chat: the per-turn prompt size should level off once old turns are summarized
+    {"name": "conversation50", "topk": 3, "warm": False, "sessions": 1, "follow_ups": 50, "iterations": 1},
+    # New conversations on a topic fetched earlier: answered from the local passage index
+    {"name": "repeat-topic", "topk": 3, "warm": True, "sessions": 1, "topic": "bitcoin price market",
+     "queries": ["bitcoin market analysts", "trading volume investors bitcoin", "bitcoin price percent"]},
+]
+FOLLOW_UPS = 3
+# Differences below this many seconds are noise, not regressions
+MIN_REGRESSION_SECONDS = 0.02
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.prompt_tokens: List[List[int]] = []
+
+    def add(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    @contextlib.asynccontextmanager
+    async def timed(self, stage: str):
+        start = time.perf_counter()
+        yield
+        self.add(stage, time.perf_counter() - start)
+
+def reset_caches():
+    cache = page_cache.get_page_cache()
+    if cache is not None:
+        cache.clear()
+    scoreboard = host_scores.get_host_scoreboard()
+    if scoreboard is not None:
+        scoreboard.clear()
+    index = passage_index.get_passage_index()
+    if index is not None:
+        index.clear()
+    search_cache.get_search_cache().clear()
+    cache_registry.get_cache_registry().close()
+
+async def drive_session(app_module, recorder: Recorder, query: str, session_id: str, follow_ups: int = FOLLOW_UPS):
+    request = SimpleNamespace(session_hash=session_id)
+    history = []
+    for turn, message in enumerate([query] + [f"Follow-up question {i} about {query}" for i in range(follow_ups)]):
+        stage = "process_query.init" if turn == 0 else "process_query.turn"
+        start = time.perf_counter()
+        first = None
+        answer = ""
+        async for answer in app_module.app.process_query(message, history, request):
+            if first is None:
+                first = time.perf_counter() - start
+        recorder.add(stage, time.perf_counter() - start)
+        if turn:
+            recorder.add("process_query.first_token", first)
+        history += [{"role": "user", "content": message}, {"role": "assistant", "content": answer}]
+    recorder.prompt_tokens.append(list(app_module.app.sessions.get(session_id).history.prompt_tokens))
+    # Leaving the session releases its cached content like an idle eviction would
+    app_module.app.sessions.drop(session_id)
+
+async def run_iteration(app_module, recorder: Recorder, scenario: dict, query: str):
+    topk = scenario["topk"]
+    if not scenario["warm"]:
+        reset_caches()
+    async with recorder.timed("search_google"):
+        await asyncio.to_thread(websearch.search_google, query, topk)
+
+    if not scenario["warm"]:
+        reset_caches()
+    async with recorder.timed("get_context"):
+        await app_module.get_context(query, topk)
+
+    if not scenario["warm"]:
+        reset_caches()
+    async with recorder.timed("search_and_cache"):
+        cache, _ = await app_module.search_and_cache(query)
+    cache_registry.get_cache_registry().release(cache)
+
+    if not scenario["warm"]:
+        reset_caches()
+    await asyncio.gather(*(
+        drive_session(app_module, recorder, query, f"{scenario['name']}-{session}", scenario.get("follow_ups", FOLLOW_UPS))
+        for session in range(scenario["sessions"])
+    ))
+
+async def run_scenario(app_module, scenario: dict, iterations: int) -> dict:
+    recorder = Recorder()
+    iterations = scenario.get("iterations", iterations)
+    reset_caches()
+    if scenario["warm"]:
+        # Prime every cache layer once with the query that is measured (or the scenario's topic)
+        await run_iteration(app_module, Recorder(), dict(scenario, warm=False), scenario.get("topic", scenario["name"]))
+        passage_index.wait_for_indexing()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for iteration in range(iterations):
+        if "queries" in scenario:
+            query = scenario["queries"][iteration % len(scenario["queries"])]
+        else:
+            query = scenario["name"] if scenario["warm"] else f"{scenario['name']} query {iteration} {time.time()}"
+        await run_iteration(app_module, recorder, scenario, query)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "config": scenario,
+        "iterations": iterations,
+        "wall_seconds": elapsed,
+        "memory_peak_mb": peak / 1e6,
+        "stages": {stage: summarize(values) for stage, values in sorted(recorder.samples.items())},
+        # Estimated history tokens sent with each follow-up, for the first conversation driven
+        "prompt_tokens": recorder.prompt_tokens[0] if recorder.prompt_tokens else [],
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, scenario in results["scenarios"].items():
+        base_scenario = baseline.get("scenarios", {}).get(name)
+        if base_scenario is None:
+            continue
+        for stage, stats in scenario["stages"].items():
+            base_stats = base_scenario["stages"].get(stage)
+            if base_stats is None:
+                continue
+            for metric in ("p50", "p95"):
+                current, base = stats[metric], base_stats[metric]
+                if current > base * (1 + tolerance) and current - base > MIN_REGRESSION_SECONDS:
+                    regressions.append(f"{name} {stage} {metric}: {base:.3f}s -> {current:.3f}s")
+        current, base = scenario["memory_peak_mb"], base_scenario["memory_peak_mb"]
+        if current > base * (1 + tolerance):
+            regressions.append(f"{name} memory peak: {base:.1f} MB -> {current:.1f} MB")
+    return regressions
+
+def print_report(results: dict):
+    for name, scenario in results["scenarios"].items():
+        print(f"\n{name}  (wall {scenario['wall_seconds']:.1f}s, memory peak {scenario['memory_peak_mb']:.1f} MB)")
+        for stage, stats in scenario["stages"].items():
+            print(f"  {stage:<28} n={stats['count']:<4} p50 {stats['p50'] * 1000:8.1f} ms"
+                  f"   p95 {stats['p95'] * 1000:8.1f} ms   p99 {stats['p99'] * 1000:8.1f} ms")
+        tokens = scenario.get("prompt_tokens")
+        if tokens:
+            print(f"  {'history tokens per turn':<28} first {tokens[0]}   max {max(tokens)}   last {tokens[-1]}")
+
+async def main(args) -> int:
+    web = offline.OfflineWeb().start()
+    offline.install_gemini_stub()
+    websearch.CSE_URL = web.cse_url
+    # Fail the "timeout" sites well before they answer, as a real deadline would
+    websearch.FETCH_TIMEOUT = httpx.Timeout(args.fetch_timeout, connect=1.0)
+
+    # Importing the app builds the Gradio interface; its output is not part of the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        app_module = __import__(args.app)
+
+    selected = [scenario for scenario in SCENARIOS if not args.scenario or scenario["name"] in args.scenario]
+    results = {
+        "meta": {
+            "app": args.app,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scenarios": {},
+    }
+    try:
+        for scenario in selected:
+            print(f"Running {scenario['name']} ...", file=sys.stderr)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results["scenarios"][scenario["name"]] = await run_scenario(app_module, scenario, args.iterations)
+    finally:
+        web.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    parser.add_argument("--app", default="app", choices=["app", "vn_chat"], help="entry point to drive")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--scenario", action="append", help="run only the named scenario(s)")
+    parser.add_argument("--fetch-timeout", type=float, default=2.0)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    sys.exit(asyncio.run(main(parser.parse_args())))
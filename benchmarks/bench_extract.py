@@ -0,0 +1,97 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from typing import List, Tuple
+import bs4
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+from langchain.docstore.document import Document
+from extract import extract_pages
+
+# Throughput of the extraction engine against the previous WebBaseLoader + preprocess_documents path
+
+WORDS = (
+    "bitcoin price market today analysts said trading volume rose fell percent investors "
+    "giá vàng hôm nay tăng mạnh thị trường nhà đầu tư the of and to in report week data"
+).split()
+
+def sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+# A realistic news-like page: heavy head scripts, navigation, an article and a long footer
+def synthetic_page(rng: random.Random, target_bytes: int) -> str:
+    head = "".join(f"<script>var a{i} = {{'k': '{'x' * 400}'}};</script>" for i in range(20))
+    head += "<style>" + ".c { color: red; } " * 200 + "</style>"
+    nav = "<nav><ul>" + "".join(f"<li><a href='/s{i}'>Section {i}</a></li>" for i in range(80)) + "</ul></nav>"
+    footer = "<footer>" + "".join(f"<p>Cookie policy &copy; link {i}</p>" for i in range(60)) + "</footer>"
+    paragraphs = []
+    size = len(head) + len(nav) + len(footer)
+    while size < target_bytes:
+        paragraph = f"<p>{' '.join(sentence(rng) for _ in range(6))}</p>"
+        paragraphs.append(paragraph)
+        size += len(paragraph)
+    return (
+        "<!DOCTYPE html><html lang='en'><head><title>Market report</title>"
+        "<meta name='description' content='Daily market report'>"
+        f"{head}</head><body>{nav}<main><article><h1>Market report</h1>{''.join(paragraphs)}"
+        f"</article></main><aside>Related stories</aside>{footer}</body></html>"
+    )
+
+def legacy_extract(pages: List[Tuple[str, str]]) -> List[Document]:
+    docs = []
+    for url, html in pages:
+        soup = BeautifulSoup(html, "html.parser", parse_only=bs4.SoupStrainer())
+        metadata = {"source": url}
+        if title := soup.find("title"):
+            metadata["title"] = title.get_text()
+        if description := soup.find("meta", attrs={"name": "description"}):
+            metadata["description"] = description.get("content", "No description found.")
+        if html_tag := soup.find("html"):
+            metadata["language"] = html_tag.get("lang", "No language found.")
+        text = re.sub(r'\s+', ' ', soup.get_text()).strip()
+        text = re.sub(r'<script.*?</script>', '', text, flags=re.DOTALL)
+        text = re.sub(r'<style.*?</style>', '', text, flags=re.DOTALL)
+        text = re.sub(r'[^\w\s.,?!()/;-]', '', text)
+        text = re.sub(r'\s+', ' ', text).strip()
+        docs.append(Document(page_content=text, metadata=metadata))
+    return docs
+
+def load_corpus(args) -> List[Tuple[str, str]]:
+    if args.html_dir:
+        pages = []
+        for name in sorted(os.listdir(args.html_dir)):
+            with open(os.path.join(args.html_dir, name), encoding="utf-8", errors="replace") as f:
+                pages.append((f"file://{name}", f.read()))
+        return pages
+    rng = random.Random(0)
+    return [(f"https://example{i}.com/article", synthetic_page(rng, args.size * 1024)) for i in range(args.pages)]
+
+def run(name: str, fn, pages, repeat: int):
+    fn(pages)  # warm-up (imports, process pool start)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        docs = fn(pages)
+    elapsed = time.perf_counter() - start
+    chars = sum(len(doc.page_content) for doc in docs) / len(docs)
+    print(f"{name:<18} {len(pages) * repeat / elapsed:10.1f} pages/s   avg text {chars:10.0f} chars")
+    return elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark HTML-to-text extraction")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--size", type=int, default=500, help="synthetic page size in KB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--html-dir", help="directory of saved HTML pages to use instead of synthetic ones")
+    args = parser.parse_args()
+
+    pages = load_corpus(args)
+    total_mb = sum(len(html) for _, html in pages) / 1e6
+    print(f"{len(pages)} pages, {total_mb:.1f} MB")
+    legacy = run("legacy", legacy_extract, pages, args.repeat)
+    serial = run("lxml serial", lambda p: extract_pages(p, parallel=False), pages, args.repeat)
+    parallel = run("lxml process pool", lambda p: extract_pages(p, parallel=True), pages, args.repeat)
+    print(f"speedup: serial {legacy / serial:.1f}x, pool {legacy / parallel:.1f}x")
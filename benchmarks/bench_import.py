@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+# Cold import time of each entry point, measured in a fresh interpreter per run, and the heavy
+# dependencies each import pulls in.
+# Usage:
+#   python benchmarks/bench_import.py --output imports.json
+#   python benchmarks/bench_import.py --baseline imports.json --tolerance 0.25   (exit 1 on regression)
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+ENTRY_POINTS = ["core", "chat_gemini", "batch", "app", "vn_chat"]
+HEAVY_MODULES = [
+    "gradio", "google.generativeai", "google.api_core", "langchain_core", "httpx", "lxml", "numpy",
+    "prometheus_client", "bs4", "requests",
+]
+# Differences below this many seconds are noise, not regressions
+MIN_REGRESSION_SECONDS = 0.05
+
+PROBE = """
+import sys, json, time, warnings
+warnings.simplefilter("ignore")
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+def measure(module: str) -> dict:
+    code = PROBE.format(src=SRC, module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=SRC, capture_output=True, text=True, check=True)
+    # The entry point may print while importing; the probe's report is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def run(modules: List[str], repeats: int) -> Dict[str, dict]:
+    results = {}
+    for module in modules:
+        print(f"Importing {module} ...", file=sys.stderr)
+        runs = [measure(module) for _ in range(repeats)]
+        seconds = [run["seconds"] for run in runs]
+        results[module] = {
+            "runs": repeats,
+            "median": statistics.median(seconds),
+            "min": min(seconds),
+            "max": max(seconds),
+            "loaded": runs[-1]["loaded"],
+        }
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for module, stats in results.items():
+        base = baseline.get(module)
+        if base is None:
+            continue
+        if stats["median"] > base["median"] * (1 + tolerance) and stats["median"] - base["median"] > MIN_REGRESSION_SECONDS:
+            regressions.append(f"{module}: {base['median']:.3f}s -> {stats['median']:.3f}s")
+    return regressions
+
+def print_report(results: dict, baseline: dict):
+    for module, stats in results.items():
+        line = f"  {module:<12} median {stats['median'] * 1000:8.1f} ms   min {stats['min'] * 1000:8.1f} ms"
+        base = baseline.get(module)
+        if base is not None:
+            line += f"   baseline {base['median'] * 1000:8.1f} ms ({base['median'] / stats['median']:.1f}x)"
+        print(line)
+        print(f"  {'':<12} loads: {', '.join(stats['loaded']) or '-'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold import time of the entry points")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS, help="modules to import (default: all entry points)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    results = run(args.modules, args.repeats)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,273 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import datetime
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import google.generativeai as genai
+from google.generativeai import caching
+from bench_extract import synthetic_page
+
+# Local stand-ins for the Custom Search endpoint, the websites it returns and the Gemini API
+
+# Site behaviours, repeated over the site list: most sites serve their own large pages, the rest
+# misbehave, serve a syndicated copy of the first site's pages ("mirror"), a PDF ("pdf") or an
+# HTML page that never ends ("endless")
+SITE_KINDS = [
+    "large", "large", "slow", "large", "redirect", "large", "missing", "large", "timeout", "mirror", "pdf", "endless",
+]
+SLOW_SECONDS = 0.8
+TIMEOUT_SECONDS = 4.0
+CSE_SECONDS = 0.05
+PAGE_SIZES_KB = (60, 150, 300, 600)
+PDF_BYTES = 5 * 1024 * 1024
+
+# Gemini stub timings
+CACHE_CREATE_SECONDS = 0.2
+CACHE_CREATE_SECONDS_PER_MB = 0.5
+FIRST_TOKEN_SECONDS = 0.3
+CHUNK_SECONDS = 0.02
+ANSWER_CHUNKS = 20
+
+def query_id(query: str) -> int:
+    return int(hashlib.md5(query.encode()).hexdigest()[:8], 16)
+
+class _Server:
+    def __init__(self, handler):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status: int, body: bytes = b"", headers: dict = None):
+        try:
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # Chunked response that only stops when the client hangs up
+    def send_forever(self, head: bytes, chunk: bytes, headers: dict):
+        try:
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for data in itertools.chain([head], itertools.repeat(chunk)):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+# One server per site so that every site has its own host:port, like distinct domains
+class SiteServer(_Server):
+    def __init__(self, kind: str, pages: dict):
+        self.kind = kind
+        self.pages = pages
+        site = self
+
+        class Handler(_Handler):
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if site.kind == "missing":
+                    return self.send(404, b"not found")
+                if site.kind == "redirect" and not path.endswith("/final"):
+                    return self.send(302, headers={"Location": f"{path}/final"})
+                if site.kind == "slow":
+                    time.sleep(SLOW_SECONDS)
+                if site.kind == "timeout":
+                    time.sleep(TIMEOUT_SECONDS)
+                if site.kind == "pdf":
+                    return self.send(200, b"%PDF-1.7\n" + b"\0" * PDF_BYTES, {"Content-Type": "application/pdf"})
+                article = int(path.split("/")[2])
+                html = pages[PAGE_SIZES_KB[article % len(PAGE_SIZES_KB)]]
+                if site.kind == "endless":
+                    body_start = html.index(b"<main>")
+                    return self.send_forever(html[:body_start], html[body_start:], {"Content-Type": "text/html"})
+                etag = f'"{article}"'
+                headers = {"ETag": etag, "Cache-Control": "max-age=300"}
+                if self.headers.get("If-None-Match") == etag:
+                    return self.send(304, headers=headers)
+                headers["Content-Type"] = "text/html; charset=utf-8"
+                self.send(200, html, headers)
+
+        super().__init__(Handler)
+
+# Fake Custom Search: every query maps to a deterministic rotation over the sites
+class SearchServer(_Server):
+    def __init__(self, sites: list):
+        self.calls = 0
+        search = self
+
+        class Handler(_Handler):
+            def do_GET(self):
+                search.calls += 1
+                time.sleep(CSE_SECONDS)
+                params = parse_qs(urlsplit(self.path).query)
+                query = params.get("q", [""])[0]
+                start = int(params.get("start", ["1"])[0])
+                num = int(params.get("num", ["10"])[0])
+                article = query_id(query) % 100000
+                items = []
+                for position in range(start - 1, start - 1 + num):
+                    site = sites[(article + position) % len(sites)]
+                    link = f"http://127.0.0.1:{site.port}/article/{article}"
+                    items.append({"title": f"Result {position + 1}", "link": link, "snippet": query})
+                self.send(200, json.dumps({"items": items}).encode(), {"Content-Type": "application/json"})
+
+        super().__init__(Handler)
+
+class OfflineWeb:
+    def __init__(self, sites: int = 30):
+        rng = random.Random(0)
+        self.sites = []
+        for i in range(sites):
+            kind = SITE_KINDS[i % len(SITE_KINDS)]
+            if kind == "mirror":
+                pages = self.sites[0].pages
+            else:
+                pages = {size: synthetic_page(rng, size * 1024).encode() for size in PAGE_SIZES_KB}
+            self.sites.append(SiteServer(kind, pages))
+        self.search = SearchServer(self.sites)
+
+    @property
+    def cse_url(self) -> str:
+        return f"http://127.0.0.1:{self.search.port}/customsearch/v1"
+
+    def start(self):
+        for server in self.sites + [self.search]:
+            server.start()
+        return self
+
+    def stop(self):
+        for server in self.sites + [self.search]:
+            server.stop()
+
+# Gemini stand-ins with the attributes the app uses
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, cached_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = cached_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+class FakeCountTokens:
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+class FakeChunk:
+    def __init__(self, text: str, usage_metadata: FakeUsage = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+def _tokens(value) -> int:
+    return len(json.dumps(value, default=str)) // 4
+
+class FakeCachedContent:
+    _counter = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model: str, contents: list, system_instruction: str, ttl: datetime.timedelta):
+        with FakeCachedContent._lock:
+            FakeCachedContent._counter += 1
+            self.name = f"cachedContents/fake-{FakeCachedContent._counter}"
+        self.model = model
+        self.token_count = _tokens(contents) + _tokens(system_instruction)
+        self.expire_time = datetime.datetime.now(datetime.timezone.utc) + ttl
+        self.deleted = False
+
+    @classmethod
+    def create(cls, model, contents=None, system_instruction=None, ttl=None, **kwargs):
+        size_mb = len(json.dumps(contents, default=str)) / 1e6
+        time.sleep(CACHE_CREATE_SECONDS + CACHE_CREATE_SECONDS_PER_MB * size_mb)
+        return cls(model, contents, system_instruction, ttl or datetime.timedelta(hours=1))
+
+    def update(self, ttl=None, **kwargs):
+        if ttl is not None:
+            self.expire_time = datetime.datetime.now(datetime.timezone.utc) + ttl
+
+    def delete(self):
+        self.deleted = True
+
+class FakeStream:
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+
+    def __iter__(self):
+        time.sleep(FIRST_TOKEN_SECONDS)
+        for chunk in self.chunks:
+            time.sleep(CHUNK_SECONDS)
+            yield chunk
+
+    async def __aiter__(self):
+        await asyncio.sleep(FIRST_TOKEN_SECONDS)
+        for chunk in self.chunks:
+            await asyncio.sleep(CHUNK_SECONDS)
+            yield chunk
+
+class FakeResponse:
+    def __init__(self, chunks: list):
+        self.text = "".join(chunk.text for chunk in chunks)
+        self.usage_metadata = chunks[-1].usage_metadata
+
+class FakeGenerativeModel:
+    def __init__(self, model_name: str = "models/fake", system_instruction=None, cached_content=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls(cached_content.model, cached_content=cached_content, **kwargs)
+
+    def _answer(self, contents) -> list:
+        cached = self.cached_content.token_count if self.cached_content is not None else 0
+        prompt = _tokens(contents) + _tokens(self.system_instruction) + cached
+        chunks = [FakeChunk(f"token{i} ") for i in range(ANSWER_CHUNKS)]
+        chunks[-1].usage_metadata = FakeUsage(prompt, cached, ANSWER_CHUNKS * 2)
+        return chunks
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        chunks = self._answer(contents)
+        if stream:
+            return FakeStream(chunks)
+        time.sleep(FIRST_TOKEN_SECONDS + CHUNK_SECONDS * len(chunks))
+        return FakeResponse(chunks)
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        chunks = self._answer(contents)
+        if stream:
+            return FakeStream(chunks)
+        await asyncio.sleep(FIRST_TOKEN_SECONDS + CHUNK_SECONDS * len(chunks))
+        return FakeResponse(chunks)
+
+    def count_tokens(self, contents, **kwargs):
+        return FakeCountTokens(_tokens(contents) + _tokens(self.system_instruction))
+
+# Every module looks these up through the genai/caching modules at call time
+def install_gemini_stub():
+    genai.GenerativeModel = FakeGenerativeModel
+    caching.CachedContent = FakeCachedContent
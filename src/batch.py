@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Optional, Set
+from websearch import search_google_async
+from context_builder import build_context
+from core import MODEL_NAME, generation_config, system_instruction, chunk_text, gemini
+import rate_limit
+import telemetry
+
+# Batch mode: answer queued questions from a JSONL file, many at a time.
+# Usage:
+#   python src/batch.py queries.jsonl --output answers.jsonl --concurrency 8
+# Each input line is {"query": ..., "id": ..., "lan": "en", "topk": 3}; only "query" is required and
+# the id defaults to the line number. Answers are appended to the output as they finish, and the
+# output doubles as the checkpoint: rerunning the same command skips every id already answered.
+# Failed queries are written with an "error" field and are tried again on the next run.
+DEFAULT_TOPK = 3
+REPORT_SECONDS = 5.0
+
+def load_queries(path: str) -> list:
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"query": item}
+            item.setdefault("id", line_number)
+            queries.append(item)
+    return queries
+
+# Ids already answered in the output; a line cut off by an interrupted write is removed
+def load_checkpoint(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    done = set()
+    for line in data.decode("utf-8").splitlines():
+        record = json.loads(line)
+        if "error" not in record:
+            done.add(str(record["id"]))
+    return done
+
+class Progress:
+    def __init__(self, total: int, skipped: int):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def line(self) -> str:
+        minutes = (time.monotonic() - self.started) / 60
+        rate = self.done / minutes if minutes else 0.0
+        return (f"{self.skipped + self.done}/{self.total} done ({self.skipped} from checkpoint), "
+                f"{self.failed} failed, {rate:.1f} queries/min")
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(REPORT_SECONDS)
+            print(f"\r{self.line()}", end="", file=sys.stderr, flush=True)
+
+async def generate(query: str, context: str, lan: str = "en") -> tuple:
+    # One-off questions do not reuse their context, so it goes inline rather than into a cached content
+    model = gemini().GenerativeModel(
+        MODEL_NAME,
+        system_instruction=f"{system_instruction(lan)}\n\n{context}",
+        generation_config=generation_config,
+    )
+
+    async def call():
+        await rate_limit.acquire("gemini")
+        with telemetry.span("generate", stream=False) as generate_span:
+            response = await model.generate_content_async(query)
+            telemetry.record_usage(response.usage_metadata, generate_span)
+        return response
+
+    response = await rate_limit.retry(call)
+    return chunk_text(response), response.usage_metadata
+
+async def answer(item: dict) -> dict:
+    query = item["query"]
+    lan = item.get("lan", "en")
+    started = time.perf_counter()
+    with telemetry.span("batch_query", query=query):
+        docs = await search_google_async(query, item.get("topk", DEFAULT_TOPK), lan)
+        context, report = await asyncio.to_thread(build_context, query, docs, lan)
+        text, usage = await generate(query, context, lan)
+    return {
+        "id": item["id"],
+        "query": query,
+        "lan": lan,
+        "answer": text,
+        "sources": [doc.metadata.get("source", "N/A") for doc in docs],
+        "context_tokens": report.kept_tokens,
+        "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+async def run(queries: list, output: str, concurrency: int) -> Progress:
+    done = load_checkpoint(output)
+    todo = [item for item in queries if str(item["id"]) not in done]
+    progress = Progress(len(queries), len(queries) - len(todo))
+    queue = asyncio.Queue()
+    for item in todo:
+        queue.put_nowait(item)
+
+    with open(output, "a", encoding="utf-8") as out:
+        def write(record: dict):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+        async def worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    record = await answer(item)
+                except Exception as e:
+                    progress.failed += 1
+                    record = {"id": item["id"], "query": item["query"], "error": f"{type(e).__name__}: {e}"}
+                else:
+                    progress.done += 1
+                write(record)
+
+        reporter = asyncio.create_task(progress.report())
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            reporter.cancel()
+            print(f"\r{progress.line()}", file=sys.stderr)
+    return progress
+
+def per_second(per_minute: float) -> Optional[float]:
+    return per_minute / 60 if per_minute > 0 else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer queued queries from a JSONL file")
+    parser.add_argument("input", help="JSONL file of queries")
+    parser.add_argument("--output", required=True, help="JSONL file of answers, also used to resume")
+    parser.add_argument("--concurrency", type=int, default=8, help="queries in flight at once")
+    parser.add_argument("--cse-per-minute", type=float, default=60, help="Custom Search calls per minute (0: no limit)")
+    parser.add_argument("--fetch-per-minute", type=float, default=1200, help="page fetches per minute (0: no limit)")
+    parser.add_argument("--gemini-per-minute", type=float, default=60, help="Gemini requests per minute (0: no limit)")
+    parser.add_argument("--retries", type=int, default=4, help="attempts per call on 429/5xx responses")
+    args = parser.parse_args()
+
+    rate_limit.configure(
+        retry_attempts=args.retries,
+        cse=per_second(args.cse_per_minute),
+        fetch=per_second(args.fetch_per_minute),
+        gemini=per_second(args.gemini_per_minute),
+    )
+    progress = asyncio.run(run(load_queries(args.input), args.output, args.concurrency))
+    sys.exit(1 if progress.failed else 0)
@@ -0,0 +1,200 @@
+import os
+import time
+import hashlib
+import datetime
+import threading
+from typing import Dict, Optional
+from context_builder import estimate_tokens
+from core import gemini
+import telemetry
+
+# Registry of Gemini CachedContent keyed by what was uploaded, so identical contexts share one cache
+CACHE_TTL = datetime.timedelta(minutes=int(os.getenv("GEMINI_CACHE_TTL_MINUTES", 15)))
+# Unreferenced caches stay around briefly for reuse by the next identical query, then get deleted
+CACHE_UNREFERENCED_GRACE = int(os.getenv("GEMINI_CACHE_GRACE_SECONDS", 120))
+# Gemini 1.5 refuses to cache fewer tokens than this; smaller contexts are sent inline instead
+MIN_CACHE_TOKENS = int(os.getenv("GEMINI_MIN_CACHE_TOKENS", 32768))
+
+def content_hash(model_name: str, system_instruction: str, context: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model_name, system_instruction, context):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class CacheHandle:
+    def __init__(self, key: str, model, inline: bool = False):
+        self.key = key
+        self.model = model
+        self.inline = inline
+        self.released = False
+
+class CacheEntry:
+    def __init__(self, model_name: str, system_instruction: str, context: str):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.context = context
+        self.cache = None
+        self.model = None
+        self.expires_at = 0.0
+        self.refs = 0
+        self.released_at = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def live(self) -> bool:
+        return self.cache is not None and self.expires_at > time.time()
+
+class CacheRegistry:
+    def __init__(self, ttl: datetime.timedelta = CACHE_TTL, grace: int = CACHE_UNREFERENCED_GRACE,
+                 min_tokens: int = MIN_CACHE_TOKENS):
+        self.ttl = ttl
+        self.grace = grace
+        self.min_tokens = min_tokens
+        self._entries: Dict[str, CacheEntry] = {}
+        self._lock = threading.Lock()
+        self._counters = {"created": 0, "reused": 0, "extended": 0, "recreated": 0, "deleted": 0, "inline": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _create(self, entry: CacheEntry):
+        with telemetry.span("cache_create", model=entry.model_name, chars=len(entry.context)):
+            entry.cache = gemini().caching.CachedContent.create(
+                model=entry.model_name,
+                system_instruction=entry.system_instruction,
+                contents=[entry.context],
+                ttl=self.ttl,
+            )
+        entry.model = gemini().GenerativeModel.from_cached_content(cached_content=entry.cache)
+        entry.expires_at = time.time() + self.ttl.total_seconds()
+
+    def _inline(self, key: str, model_name: str, system_instruction: str, context: str) -> CacheHandle:
+        self._count("inline")
+        model = gemini().GenerativeModel(model_name, system_instruction=f"{system_instruction}\n\n{context}")
+        return CacheHandle(key, model, inline=True)
+
+    def acquire(self, model_name: str, system_instruction: str, context: str) -> CacheHandle:
+        from google.api_core import exceptions
+
+        key = content_hash(model_name, system_instruction, context)
+        if estimate_tokens(system_instruction) + estimate_tokens(context) < self.min_tokens:
+            return self._inline(key, model_name, system_instruction, context)
+
+        self._sweep()
+        with self._lock:
+            entry = self._entries.setdefault(key, CacheEntry(model_name, system_instruction, context))
+            entry.refs += 1
+        with entry.lock:
+            telemetry.cache_lookup("gemini", hit=entry.live)
+            # The reference taken above is dropped on every failure, or the entry could never be swept
+            try:
+                if entry.live:
+                    self._count("reused")
+                    self._refresh(entry)
+                else:
+                    self._create(entry)
+                    self._count("created")
+            except exceptions.InvalidArgument:
+                # The token estimate was off and the provider rejected a too-small context
+                with self._lock:
+                    entry.refs -= 1
+                    if entry.refs == 0 and entry.cache is None:
+                        self._entries.pop(key, None)
+                return self._inline(key, model_name, system_instruction, context)
+            except Exception:
+                with self._lock:
+                    entry.refs -= 1
+                    if entry.refs == 0:
+                        entry.released_at = time.time()
+                raise
+            return CacheHandle(key, entry.model)
+
+    def _extend(self, entry: CacheEntry):
+        entry.cache.update(ttl=self.ttl)
+        entry.expires_at = time.time() + self.ttl.total_seconds()
+        self._count("extended")
+
+    # Extend a cache past half its TTL, recreating it if it expired or was removed on the provider side
+    def _refresh(self, entry: CacheEntry):
+        from google.api_core import exceptions
+
+        if not entry.live:
+            self._create(entry)
+            self._count("recreated")
+        elif entry.expires_at - time.time() < self.ttl.total_seconds() / 2:
+            try:
+                self._extend(entry)
+            except exceptions.NotFound:
+                self._create(entry)
+                self._count("recreated")
+
+    # Called before every turn so the cache stays alive while the session is active
+    def touch(self, handle: CacheHandle):
+        if handle.inline:
+            return handle.model
+        entry = self._entries.get(handle.key)
+        if entry is None:
+            raise KeyError(f"Unknown cached content {handle.key}")
+        with entry.lock:
+            self._refresh(entry)
+            handle.model = entry.model
+        return handle.model
+
+    def release(self, handle: Optional[CacheHandle]):
+        if handle is None or handle.inline or handle.released:
+            return
+        handle.released = True
+        with self._lock:
+            entry = self._entries.get(handle.key)
+            if entry is not None:
+                entry.refs -= 1
+                if entry.refs == 0:
+                    entry.released_at = time.time()
+        self._sweep()
+
+    # Delete caches nobody has referenced for longer than the grace period
+    def _sweep(self):
+        now = time.time()
+        with self._lock:
+            stale = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry.refs == 0 and (now - entry.released_at > self.grace or not entry.live)
+            ]
+            for key, _ in stale:
+                del self._entries[key]
+        if not stale:
+            return
+        from google.api_core import exceptions
+        for _, entry in stale:
+            if entry.live:
+                try:
+                    entry.cache.delete()
+                    self._count("deleted")
+                except exceptions.GoogleAPIError as e:
+                    print(f"Failed to delete cached content {entry.cache.name}: {e}")
+
+    def close(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.refs = 0
+                entry.released_at = 0.0
+        self._sweep()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["live"] = sum(1 for entry in self._entries.values() if entry.live)
+            stats["referenced"] = sum(1 for entry in self._entries.values() if entry.refs > 0)
+        return stats
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_cache_registry() -> CacheRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CacheRegistry()
+    return _registry
@@ -0,0 +1,160 @@
+import os
+import math
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+from dedup import SHINGLE_MULTIPLIERS, mix, word_hashes
+import telemetry
+
+# Query-focused context builder: split pages into passages, rank them with BM25 and pack a token budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 48000))
+PASSAGE_WORDS = 120
+CHARS_PER_TOKEN = 4
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Word bytes: ASCII letters, digits and underscore, and every byte of a non-ASCII character. On text
+# that went through normalize_text this finds the same words as \w+.
+WORD_BYTES = np.zeros(256, dtype=bool)
+WORD_BYTES[np.frombuffer(b"0123456789_ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz", dtype=np.uint8)] = True
+WORD_BYTES[128:] = True
+# Texts are hashed in batches of about this many bytes, which bounds the temporary arrays
+TERM_BATCH_BYTES = 1 << 20
+
+@dataclass
+class Passage:
+    doc_index: int
+    position: int
+    text: str
+
+@dataclass
+class ContextReport:
+    total_tokens: int
+    kept_tokens: int
+    dropped_tokens: int
+    total_passages: int
+    kept_passages: int
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _batch_terms(encoded: List[bytes], lan: str) -> Tuple[np.ndarray, np.ndarray]:
+    data = np.frombuffer(b" ".join(encoded), dtype=np.uint8)
+    text_starts = np.cumsum([0] + [len(text) + 1 for text in encoded[:-1]])
+    edges = np.diff(np.concatenate(([0], WORD_BYTES[data], [0])).astype(np.int8))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    hashes = word_hashes(data, starts, ends)
+    rows = np.searchsorted(text_starts, starts, side="right") - 1
+    if lan == 'vi':
+        # Vietnamese words are written as space separated syllables, so adjacent syllable pairs are added as terms
+        same_text = rows[1:] == rows[:-1]
+        with np.errstate(over="ignore"):
+            pairs = mix(hashes[:-1] * SHINGLE_MULTIPLIERS[0] + hashes[1:] * SHINGLE_MULTIPLIERS[1])
+        hashes = np.concatenate((hashes, pairs[same_text]))
+        rows = np.concatenate((rows, rows[:-1][same_text]))
+    return hashes, rows
+
+# Terms of many texts at once, as 64-bit hashes of the lowercased words, with the index of the text each
+# term comes from. Hashes are the same in every process, so they can be stored.
+def term_hashes(texts: List[str], lan: str = 'en') -> Tuple[np.ndarray, np.ndarray]:
+    hashes, rows = [np.zeros(0, dtype=np.uint64)], [np.zeros(0, dtype=np.int64)]
+    batch, size, first = [], 0, 0
+    for index, text in enumerate(texts):
+        batch.append(unicodedata.normalize("NFC", text).lower().encode("utf-8"))
+        size += len(batch[-1]) + 1
+        if size >= TERM_BATCH_BYTES or index == len(texts) - 1:
+            batch_hashes, batch_rows = _batch_terms(batch, lan)
+            hashes.append(batch_hashes)
+            rows.append(batch_rows + first)
+            batch, size, first = [], 0, index + 1
+    return np.concatenate(hashes), np.concatenate(rows)
+
+# Passages are consecutive runs of passage_words words: a passage always filled up to its size, even
+# in the middle of a sentence, so the text only needs splitting into words once
+def split_passages(doc_index: int, text: str, passage_words: int = PASSAGE_WORDS) -> List[Passage]:
+    words = text.split()
+    return [
+        Passage(doc_index, position, " ".join(words[start:start + passage_words]))
+        for position, start in enumerate(range(0, len(words), passage_words))
+    ]
+
+# Term counts come from one vectorized pass over all passages: each term hash is looked up among the
+# sorted query terms and the matches are counted with bincount
+def bm25_scores(query: str, passages: List[Passage], lan: str = 'en') -> np.ndarray:
+    terms = np.unique(term_hashes([query], lan)[0])
+    if not len(terms) or not passages:
+        return np.zeros(len(passages))
+
+    hashes, rows = term_hashes([passage.text for passage in passages], lan)
+    lengths = np.bincount(rows, minlength=len(passages)).astype(np.float32)
+    columns = np.minimum(np.searchsorted(terms, hashes), len(terms) - 1)
+    matched = terms[columns] == hashes
+    tf = np.bincount(
+        rows[matched] * len(terms) + columns[matched], minlength=len(passages) * len(terms)
+    ).reshape(len(passages), len(terms)).astype(np.float32)
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((len(passages) - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1.0))
+    return ((tf * (BM25_K1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+def format_document(index: int, doc: Document, content: str) -> str:
+    # Near-duplicate copies removed by dedup stay citable through the kept copy
+    duplicates = doc.metadata.get('duplicate_sources')
+    also = f"Also published at: {', '.join(duplicates)}\n" if duplicates else ""
+    return (
+        f"URL {index + 1}\n"
+        f"Source: {doc.metadata.get('source', 'N/A')}\n"
+        f"{also}"
+        f"Title: {doc.metadata.get('title', 'N/A')}\n"
+        f"Description: {doc.metadata.get('description', 'N/A')}\n"
+        f"Content: {content}\n"
+    )
+
+def build_context(query: str, docs: List[Document], lan: str = 'en',
+                  token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, ContextReport]:
+    with telemetry.span("build_context", documents=len(docs)) as context_span:
+        context, report = _build_context(query, docs, lan, token_budget)
+        context_span.set(chars=len(context), tokens=report.kept_tokens, dropped_tokens=report.dropped_tokens)
+    telemetry.observe("context_chars", len(context))
+    telemetry.observe("context_tokens", report.kept_tokens)
+    return context, report
+
+def _build_context(query: str, docs: List[Document], lan: str, token_budget: int) -> Tuple[str, ContextReport]:
+    passages = [passage for index, doc in enumerate(docs) for passage in split_passages(index, doc.page_content)]
+    total_tokens = sum(estimate_tokens(format_document(index, doc, "")) for index, doc in enumerate(docs))
+    total_tokens += sum(estimate_tokens(passage.text) + 1 for passage in passages)
+
+    # Best passages first; ties (including queries with no lexical match) keep page order and search rank
+    scores = bm25_scores(query, passages, lan)
+    order = sorted(range(len(passages)), key=lambda i: (-scores[i], passages[i].position, passages[i].doc_index))
+
+    selected = {}
+    used = 0
+    for i in order:
+        passage = passages[i]
+        cost = estimate_tokens(passage.text) + 1
+        if passage.doc_index not in selected:
+            cost += estimate_tokens(format_document(passage.doc_index, docs[passage.doc_index], ""))
+        if used + cost > token_budget:
+            continue
+        selected.setdefault(passage.doc_index, []).append(passage)
+        used += cost
+
+    # Put the kept passages back in reading order, keeping each page's source and title
+    context = "\n\n".join(
+        format_document(index, docs[index], " ".join(
+            passage.text for passage in sorted(selected[index], key=lambda passage: passage.position)
+        ))
+        for index in sorted(selected)
+    )
+    report = ContextReport(
+        total_tokens=total_tokens,
+        kept_tokens=used,
+        dropped_tokens=total_tokens - used,
+        total_passages=len(passages),
+        kept_passages=sum(len(kept) for kept in selected.values()),
+    )
+    return context, report
@@ -0,0 +1,260 @@
+import os
+import asyncio
+import threading
+from dataclasses import dataclass
+from datetime import date
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+import telemetry
+
+# Shared core of the entry points (app.py, vn_chat.py, chat_gemini.py, batch.py).
+# Importing it is cheap: the search pipeline, Gemini SDK and Gradio are imported on first use, and
+# the Gemini SDK is configured once per process. Page fetches share websearch's pooled HTTP client.
+
+MODEL_NAME = "models/gemini-1.5-flash-002"
+generation_config = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "max_output_tokens": 8192
+}
+DEFAULT_LANGUAGE = "en"
+DEFAULT_TOPK = 10
+
+# Prompt profiles per language; {current_date} is filled in on every call, so long-running
+# processes never tell the model a stale date
+EN_PROMPT = """
+### Role:
+You are an intelligent assistant designed to provide accurate and concise responses by leveraging the context provided through websites from Google Search. Your primary goal is to assist the user in obtaining relevant information and insights based on the sources retrieved.
+
+### Guidelines:
+
+1. **Contextual Analysis**:
+   - Carefully analyze the URLs, titles, descriptions, and content provided from the search results.
+   - Prioritize extracting the most relevant information to directly answer the user's query.
+   - **If the user asks for time-sensitive data, assume the provided context is the most up-to-date available, even if not explicitly stated as real-time.** Focus on giving an answer based on the information given, rather than admitting you don't have it.
+   - For your reference, today is {current_date}.
+
+2. **Direct and Concise Answers**:
+   - Focus on answering the user's query directly and concisely.
+   - Avoid including unnecessary information that doesn't contribute to the answer.
+   - If information is limited or not ideally specific, use the best information to provide a direct answer, noting that the information may have limitations.
+   - If there are varying sources, use all the sources while making sure that the user is aware of any discrepancies.
+
+3. **Multi-Source Synthesis**:
+    -  Synthesize information from different sources into a coherent answer, avoiding redundancy.
+   -  When sources conflict or differ, present those differences with explanations as to why that may occur.
+
+4.  **Handling Imperfect Information**:
+    - When information is not perfect, or the request is not directly answerable, use the context and make the best inference possible.
+    - Example: If the exact price is not found, but a range is provided, mention the range. If a date is not exact, use the closest information to make the inference.
+    - If a source is unreliable, mention this in the answer but still use the best available interpretation of the data.
+
+5. **Clarity and Tone**:
+   - Use formal yet approachable language suitable for a broad audience.
+   - Avoid overly technical jargon unless the user's query indicates otherwise.
+
+6. **Proactive Problem Solving**:
+   - Attempt to answer the user's question fully based on the provided context. If the context cannot fully answer the query, provide the best possible answer by combining sources and making logical inferences.
+   - **Avoid telling the user to search elsewhere. Your role is to answer based on the given context as best you can, not to suggest other sources**.
+   - For queries about real-time data, use the most current information present in the provided context. If the data is limited or not fully up-to-date, state that as a limitation while still attempting to answer the question fully with the provided context. For example: *Based on the available information, the price is between X and Y as of this article's date, but it may change rapidly.*
+"""
+
+VI_PROMPT = """
+### Vai Trò:
+Bạn là một trợ lý thông minh được thiết kế để cung cấp câu trả lời chính xác và ngắn gọn bằng cách tận dụng nội dung mới nhất từ các trang web được lấy thời gian thực thông qua Google. Mục tiêu chính của bạn là hỗ trợ người dùng có được thông tin và hiểu biết liên quan dựa trên các nguồn đã truy xuất. Hãy trả lời hoàn toàn bằng tiếng Việt.
+
+### Hướng Dẫn:
+
+1. **Hiểu Ngữ Cảnh**:
+   - Phân tích các URL, tiêu đề, mô tả và nội dung được cung cấp từ kết quả tìm kiếm.
+   - Trích xuất và ưu tiên thông tin quan trọng và hữu ích nhất cho câu hỏi của người dùng.
+   - **Thông tin nhạy cảm về thời gian có thể được hỏi, hãy coi ngữ cảnh đã cung cấp là nguồn mới nhất và thời gian thực.**
+   - Để tham khảo, hôm nay là {current_date}.
+
+2. **Ưu Tiên Thông Tin**:
+   - Tập trung trả lời câu hỏi của người dùng một cách ngắn gọn trong khi đảm bảo câu trả lời chính xác.
+   - Tránh đưa vào những chi tiết không cần thiết hoặc không mang lại giá trị cho câu trả lời.
+   - Nếu thông tin khác nhau, hãy cung cấp sự so sánh giữa các nguồn và rõ ràng chỉ ra bất kỳ sự khác biệt nào.
+
+3. **Tích Hợp Nhiều Nguồn**:
+   - Nếu nhiều nguồn được cung cấp, kết hợp thông tin một cách logic, tránh lặp lại và đảm bảo sự rõ ràng.
+   - Nếu các nguồn cung cấp thông tin mâu thuẫn, **hãy chỉ rõ sự khác biệt và nhấn mạnh bất kỳ sự mâu thuẫn hoặc biến thể nào**, giải thích các lý do có thể gây ra những khác biệt này.
+
+4. **Xử Lý Khi Không Có Thông Tin Cụ Thể**:
+   - Nếu không có dữ liệu trực tiếp trả lời câu hỏi, **hãy đưa ra dự đoán hợp lý hoặc gợi ý thông tin hữu ích dựa trên ngữ cảnh**.
+   - Ví dụ: *Không có thông tin chi tiết về thời tiết Hà Nội hôm nay, nhưng dựa trên xu hướng mùa, có thể dự đoán trời se lạnh với khả năng mưa nhẹ.*
+   - Tuyệt đối tránh câu trả lời như "Tôi xin lỗi, không có thông tin" trừ khi không thể đưa ra bất kỳ suy đoán hoặc gợi ý nào dựa trên ngữ cảnh.
+
+5. **Ngôn Ngữ và Sự Rõ Ràng**:
+   - Sử dụng ngôn ngữ trang trọng nhưng dễ tiếp cận, phù hợp với nhiều đối tượng.
+   - Tránh sử dụng thuật ngữ chuyên môn trừ khi người dùng yêu cầu các thuật ngữ kỹ thuật.
+
+6. **Xử Lý Lỗi**:
+   - Nếu không tìm thấy dữ liệu liên quan hoặc câu hỏi không rõ ràng, hãy yêu cầu người dùng làm rõ hoặc giải thích giới hạn của hệ thống.
+   - **Tránh yêu cầu người dùng tìm kiếm ở nơi khác trừ khi thực sự cần thiết**. Cố gắng cung cấp câu trả lời đầy đủ nhất có thể dựa trên ngữ cảnh hiện có.
+   - Trong trường hợp yêu cầu dữ liệu thời gian thực mà không có sẵn đầy đủ, hãy giải thích ngữ cảnh tốt nhất hiện có từ các nguồn bạn có. Ví dụ: *Dựa trên thông tin có sẵn hôm nay, giá dao động từ X đến Y, nhưng có thể thay đổi nhanh chóng.*
+"""
+
+@dataclass(frozen=True)
+class Profile:
+    lan: str
+    prompt: str
+    date_format: str
+    initialized: str
+
+PROFILES = {
+    "en": Profile("en", EN_PROMPT, "%B %d, %Y", "Context has been initialized."),
+    "vi": Profile("vi", VI_PROMPT, "ngày %d tháng %m năm %Y",
+                  "Ngữ cảnh đã được khởi tạo. Bạn có thể tiếp tục trò chuyện."),
+}
+
+# Languages without a profile of their own use the English one
+def get_profile(lan: str = DEFAULT_LANGUAGE) -> Profile:
+    return PROFILES.get(lan, PROFILES[DEFAULT_LANGUAGE])
+
+def current_date(lan: str = DEFAULT_LANGUAGE, today: Optional[date] = None) -> str:
+    return (today or date.today()).strftime(get_profile(lan).date_format)
+
+def system_instruction(lan: str = DEFAULT_LANGUAGE, today: Optional[date] = None) -> str:
+    return get_profile(lan).prompt.format(current_date=current_date(lan, today))
+
+_env_loaded = False
+_gemini = None
+_gemini_lock = threading.Lock()
+
+def load_env():
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv(os.path.join(os.path.dirname(__file__), "../.env"))
+        _env_loaded = True
+
+# The google.generativeai module, imported and configured with the API key on first use
+def gemini():
+    global _gemini
+    if _gemini is None:
+        with _gemini_lock:
+            if _gemini is None:
+                import google.generativeai as genai
+                load_env()
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                _gemini = genai
+    return _gemini
+
+# Import the search pipeline and the Gemini SDK and start the extraction workers in the background,
+# so that a process which starts with other work (launching the web server, waiting for input) is
+# ready by the first query
+def preload() -> threading.Thread:
+    def run():
+        import websearch  # noqa: F401
+        import context_builder  # noqa: F401
+        import cache_registry  # noqa: F401
+        from extract import start_process_pool
+
+        start_process_pool()
+        gemini()
+
+    thread = threading.Thread(target=run, name="core-preload", daemon=True)
+    thread.start()
+    return thread
+
+async def get_context(query: str, topk: int = DEFAULT_TOPK, lan: str = DEFAULT_LANGUAGE, **params) -> Tuple[List[str], str]:
+    from websearch import search_google_async
+    from context_builder import build_context
+
+    docs = await search_google_async(query, topk, lan, **params)
+    urls = [doc.metadata.get('source', 'N/A') for doc in docs]
+    doc_string, report = await asyncio.to_thread(build_context, query, docs, lan)
+    print(f"Context: kept {report.kept_tokens} of {report.total_tokens} estimated tokens "
+          f"({report.kept_passages}/{report.total_passages} passages, dropped {report.dropped_tokens})")
+
+    return urls, doc_string
+
+# Blocking variant for scripts; runs on websearch's long-lived loop so the connection pool is reused
+def get_context_sync(query: str, topk: int = DEFAULT_TOPK, lan: str = DEFAULT_LANGUAGE, **params) -> Tuple[List[str], str]:
+    from websearch import run_sync
+    return run_sync(get_context(query, topk, lan, **params))
+
+# Identical contexts share one CachedContent through the registry
+async def search_and_cache(query: str, lan: str = DEFAULT_LANGUAGE):
+    from cache_registry import get_cache_registry
+
+    with telemetry.span("search_and_cache", query=query):
+        urls, context = await get_context(query, lan=lan)
+        cache = await asyncio.to_thread(get_cache_registry().acquire, MODEL_NAME, system_instruction(lan), context)
+    return cache, urls
+
+# Text of one streamed chunk; chunks without text parts (e.g. a final safety chunk) yield nothing
+def chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+class ChatApp:
+    def __init__(self, lan: str = DEFAULT_LANGUAGE, stream: bool = True):
+        from sessions import SessionManager
+
+        self.lan = lan
+        self.sessions = SessionManager()
+        self.stream = stream
+
+    # Async generator handler: Gradio renders each yielded value as the partial answer
+    async def process_query(self, message, history, request):
+        from cache_registry import get_cache_registry
+        from sessions import release_cache
+
+        session = self.sessions.get(request.session_hash if request else None)
+        async with session.lock:
+            # A cleared chat starts a new conversation
+            if not history and session.cache is not None:
+                release_cache(session.reset())
+
+            if session.cache is None:  # First query initializes the model
+                session.cache, urls = await search_and_cache(message, self.lan)
+                printed_urls = "\n".join(f"Currently searching the website: {url}" for url in urls)
+                yield f"{printed_urls}\n\n{get_profile(self.lan).initialized}"
+                return
+
+            # Subsequent queries
+            model = await asyncio.to_thread(get_cache_registry().touch, session.cache)
+            contents = session.history.build(message)
+            response_content = ""
+            try:
+                with telemetry.span("generate", stream=self.stream, history_tokens=session.history.last_prompt_tokens) as generate_span:
+                    if self.stream:
+                        response = await model.generate_content_async(contents, stream=True)
+                        usage = None
+                        async for chunk in response:
+                            response_content += chunk_text(chunk)
+                            # Usage metadata arrives with the last chunk
+                            usage = getattr(chunk, "usage_metadata", None) or usage
+                            yield response_content
+                    else:
+                        response = await model.generate_content_async(contents)
+                        response_content = response.text
+                        usage = response.usage_metadata
+                        yield response_content
+                    telemetry.record_usage(usage, generate_span)
+            finally:
+                # Only completed or partially streamed answers become part of the conversation
+                if response_content:
+                    session.history.add_turn(message, response_content)
+                session.touch()
+
+# Gradio interface for a ChatApp; Gradio itself is only imported here
+def chat_interface(app: ChatApp, title: str, description: str):
+    import gradio as gr
+    from sessions import CONCURRENCY_LIMIT
+
+    # Gradio injects the request into parameters annotated with gr.Request
+    async def process_query(message, history, request: gr.Request):
+        async for answer in app.process_query(message, history, request):
+            yield answer
+
+    return gr.ChatInterface(
+        fn=process_query,
+        type="messages",
+        title=title,
+        description=description,
+        concurrency_limit=CONCURRENCY_LIMIT,
+    )
@@ -0,0 +1,20 @@
+import sqlite3
+import threading
+from typing import Callable
+
+# SQLite connections for the stores under .cache (page cache, host scores, passage index).
+# sqlite3 connections cannot be shared between threads, so each thread opens its own. WAL lets every app
+# worker read while another writes; transactions are explicit (BEGIN IMMEDIATE ... COMMIT).
+def thread_connection(path: str) -> Callable[[], sqlite3.Connection]:
+    local = threading.local()
+
+    def connection() -> sqlite3.Connection:
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            local.conn = conn
+        return conn
+
+    return connection
@@ -0,0 +1,241 @@
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+import telemetry
+
+# Near-duplicate removal: repeated passages inside a page (cookie banners, share blocks, "related
+# articles" teasers), then whole pages that are syndicated copies of a better-ranked one.
+# Passages and pages are fingerprinted with a 64-bit SimHash over word shingles. Words are hashed with
+# NumPy straight from the UTF-8 bytes, so fingerprints are the same in every process: the per-page
+# work runs once in the extraction pool and is stored with the page in the cache.
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") != "0"
+DOCUMENT_SHINGLE_WORDS = 5
+DOCUMENT_MAX_DISTANCE = 6
+PASSAGE_SHINGLE_WORDS = 3
+PASSAGE_MAX_DISTANCE = 3
+MIN_PASSAGE_WORDS = 6
+
+WHITESPACE_BYTES = np.frombuffer(b" \t\n\r\f\v", dtype=np.uint8)
+# A passage is a sentence: it ends with a word ending in one of these characters
+SENTENCE_END_BYTES = np.frombuffer(b".!?", dtype=np.uint8)
+BYTE_BASE = 0x100000001B3
+BYTE_BASE_INVERSE = pow(BYTE_BASE, -1, 2 ** 64)
+# Odd multipliers that give each position in a shingle its own weight
+SHINGLE_MULTIPLIERS = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD],
+    dtype=np.uint64,
+)
+BYTE_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float32)
+
+@dataclass
+class DedupReport:
+    documents: int
+    removed_documents: int
+    removed_passages: int
+    removed_chars: int
+
+# splitmix64 finalizer, so every output bit depends on every input bit
+def mix(values: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        values = values ^ (values >> np.uint64(30))
+        values = values * np.uint64(0xBF58476D1CE4E5B9)
+        values = values ^ (values >> np.uint64(27))
+        values = values * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+# UTF-8 bytes of the text and of its lowercase form; when lowercasing changes the byte length only
+# ASCII letters are folded, so that both arrays stay aligned
+def text_bytes(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    raw = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    lowered = np.frombuffer(text.lower().encode("utf-8"), dtype=np.uint8)
+    if len(lowered) != len(raw):
+        lowered = raw + ((raw >= ord("A")) & (raw <= ord("Z"))).astype(np.uint8) * np.uint8(32)
+    return raw, lowered
+
+# Byte offsets where each word starts and ends
+def word_spans(raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    in_word = np.concatenate(([0], ~np.isin(raw, WHITESPACE_BYTES), [0])).astype(np.int8)
+    edges = np.diff(in_word)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+# Polynomial hash of every word at once: prefix sums of byte * base^position, shifted back by the
+# inverse power at the word start (all arithmetic wraps modulo 2^64)
+def word_hashes(lowered: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        powers = np.cumprod(np.full(len(lowered), BYTE_BASE, dtype=np.uint64))
+        inverse_powers = np.cumprod(np.full(len(lowered), BYTE_BASE_INVERSE, dtype=np.uint64))
+        prefix = np.concatenate((np.zeros(1, dtype=np.uint64), np.cumsum(lowered * powers, dtype=np.uint64)))
+        return mix((prefix[ends] - prefix[starts]) * inverse_powers[starts])
+
+# Hash of every run of `size` consecutive words
+def shingle_hashes(hashes: np.ndarray, size: int) -> np.ndarray:
+    count = max(0, len(hashes) - size + 1)
+    shingles = np.zeros(count, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(size):
+            shingles += hashes[offset:offset + count] * SHINGLE_MULTIPLIERS[offset]
+    return mix(shingles)
+
+# Number of set bits at each of the 64 positions, summed over consecutive segments of `values`.
+# Short segments (passages): every bit is unpacked into a byte and eight bytes are summed at once as
+# the lanes of a uint64, which cannot carry between lanes while a segment has fewer than 256 values.
+# Few long segments (whole pages): a histogram of each byte per segment times a byte-to-bits table.
+def bit_counts(values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    value_bytes = values.view(np.uint8).reshape(-1, 8)
+    segments = len(lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    if lengths.max() < 256:
+        lanes = np.unpackbits(value_bytes, axis=1).view(np.uint64)
+        return np.add.reduceat(lanes, starts, axis=0).view(np.uint8).reshape(segments, 64)
+    if segments * 256 < len(values):
+        offsets = np.repeat(np.arange(segments) * 256, lengths)
+        totals = np.empty((segments, 64), dtype=np.float32)
+        for byte in range(8):
+            histogram = np.bincount(offsets + value_bytes[:, byte], minlength=segments * 256)
+            totals[:, byte * 8:(byte + 1) * 8] = histogram.reshape(segments, 256).astype(np.float32) @ BYTE_BITS
+        return totals
+    return np.add.reduceat(np.unpackbits(value_bytes, axis=1), starts, axis=0, dtype=np.int32)
+
+# SimHash of consecutive segments of a word hash array (word_counts words each). Shingles that would
+# cross into the next segment are masked out; segments shorter than one shingle get None.
+def simhashes(hashes: np.ndarray, word_counts: np.ndarray, shingle_words: int) -> List[Optional[int]]:
+    fingerprints = [None] * len(word_counts)
+    usable = word_counts >= shingle_words
+    if not usable.any():
+        return fingerprints
+    shingles = shingle_hashes(hashes, shingle_words)
+    # A shingle is kept when it starts at least shingle_words - 1 words before the end of its segment
+    last_start = np.repeat(np.cumsum(word_counts) - shingle_words, word_counts)[:len(shingles)]
+    shingles = shingles[np.arange(len(shingles)) <= last_start]
+    lengths = word_counts[usable] - shingle_words + 1
+    totals = bit_counts(shingles, lengths)
+    packed = np.packbits(totals * 2 > lengths[:, None], axis=1).view(np.uint64).ravel()
+    for index, fingerprint in zip(np.flatnonzero(usable), packed):
+        fingerprints[index] = int(fingerprint)
+    return fingerprints
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+# Pairs (i < j) of distinct fingerprints at most max_distance bits apart. Split into max_distance + 1
+# bands, two fingerprints that close must agree on at least one band, so candidates are the runs of
+# equal band values after a sort, checked with a vectorized popcount.
+def close_pairs(values: np.ndarray, max_distance: int) -> set:
+    bands = max_distance + 1
+    edges = [64 * band // bands for band in range(bands + 1)]
+    pairs = set()
+    for band in range(bands):
+        mask = np.uint64((1 << (edges[band + 1] - edges[band])) - 1)
+        keys = (values >> np.uint64(edges[band])) & mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        for gap in range(1, len(order)):
+            same = sorted_keys[gap:] == sorted_keys[:-gap]
+            if not same.any():
+                break
+            left, right = order[:-gap][same], order[gap:][same]
+            close = popcount(values[left] ^ values[right]) <= max_distance
+            pairs.update(zip(np.minimum(left, right)[close].tolist(), np.maximum(left, right)[close].tolist()))
+    return pairs
+
+# For each fingerprint, the index of the earlier kept fingerprint it duplicates, or -1.
+# Exact copies are folded first, then near copies join the earliest kept fingerprint they are close to.
+def near_duplicates(fingerprints: List[Optional[int]], max_distance: int) -> List[int]:
+    duplicate_of = [-1] * len(fingerprints)
+    indices = [index for index, fingerprint in enumerate(fingerprints) if fingerprint is not None]
+    if len(indices) < 2:
+        return duplicate_of
+    values = np.array([fingerprints[index] for index in indices], dtype=np.uint64)
+    _, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    distinct = np.sort(first)
+    earlier = {}
+    for left, right in close_pairs(values[distinct], max_distance):
+        earlier.setdefault(right, []).append(left)
+    kept_as = list(range(len(distinct)))
+    for right in sorted(earlier):
+        for left in sorted(earlier[right]):
+            if kept_as[left] == left:
+                kept_as[right] = left
+                break
+    slot = np.searchsorted(distinct, first[inverse.ravel()])
+    for position, index in enumerate(indices):
+        root = distinct[kept_as[slot[position]]]
+        if root != position:
+            duplicate_of[index] = indices[root]
+    return duplicate_of
+
+# Per-page stage: drop later repeats of a passage (short fragments such as "Read more" are left
+# alone) and fingerprint what remains. Returns the cleaned text, its fingerprint (None for texts
+# shorter than one shingle) and the number of passages removed.
+def clean_text(text: str) -> Tuple[str, Optional[int], int]:
+    raw, lowered = text_bytes(text)
+    starts, ends = word_spans(raw)
+    if not len(starts):
+        return text, None, 0
+    hashes = word_hashes(lowered, starts, ends)
+
+    sentence_ends = np.flatnonzero(np.isin(raw[ends - 1], SENTENCE_END_BYTES))
+    if not len(sentence_ends) or sentence_ends[-1] != len(starts) - 1:
+        sentence_ends = np.append(sentence_ends, len(starts) - 1)
+    bounds = sentence_ends + 1
+    word_counts = np.diff(bounds, prepend=0)
+    fingerprints = simhashes(hashes, word_counts, PASSAGE_SHINGLE_WORDS)
+    fingerprints = [
+        fingerprint if count >= MIN_PASSAGE_WORDS else None for fingerprint, count in zip(fingerprints, word_counts)
+    ]
+    repeated = [passage for passage, match in enumerate(near_duplicates(fingerprints, PASSAGE_MAX_DISTANCE)) if match >= 0]
+
+    if repeated:
+        keep_words = np.ones(len(starts), dtype=bool)
+        keep_bytes = np.ones(len(raw), dtype=bool)
+        for passage in repeated:
+            first_word, end_word = bounds[passage] - word_counts[passage], bounds[passage]
+            keep_words[first_word:end_word] = False
+            # The passage goes together with the whitespace that follows it
+            keep_bytes[starts[first_word]:starts[end_word] if end_word < len(starts) else len(raw)] = False
+        text = raw[keep_bytes].tobytes().decode("utf-8").rstrip()
+        hashes = hashes[keep_words]
+    fingerprint = simhashes(hashes, np.array([len(hashes)]), DOCUMENT_SHINGLE_WORDS)[0]
+    return text, fingerprint, len(repeated)
+
+# Query stage. Documents are expected in rank order: the first copy of a near-duplicate group is kept
+# and lists the sources of the others under "duplicate_sources". Pages from extract.py already carry
+# their fingerprint ("simhash"); any other document is cleaned here.
+def deduplicate(docs: List[Document]) -> Tuple[List[Document], DedupReport]:
+    if not DEDUP_ENABLED or not docs:
+        return docs, DedupReport(len(docs), 0, 0, 0)
+    with telemetry.span("dedup", documents=len(docs)) as dedup_span:
+        cleaned = []
+        removed_passages = removed_chars = 0
+        for doc in docs:
+            text, metadata = doc.page_content, dict(doc.metadata)
+            if "simhash" not in metadata:
+                text, metadata["simhash"], metadata["removed_passages"] = clean_text(text)
+                metadata["removed_chars"] = len(doc.page_content) - len(text)
+            removed_passages += metadata.get("removed_passages", 0)
+            removed_chars += metadata.get("removed_chars", 0)
+            cleaned.append(Document(page_content=text, metadata=metadata))
+
+        kept = []
+        matches = near_duplicates([doc.metadata["simhash"] for doc in cleaned], DOCUMENT_MAX_DISTANCE)
+        for doc, match in zip(cleaned, matches):
+            if match < 0:
+                kept.append(doc)
+                continue
+            removed_chars += len(doc.page_content)
+            original = cleaned[match].metadata
+            original.setdefault("duplicate_sources", []).append(doc.metadata.get("source", "N/A"))
+            original["duplicate_sources"] += doc.metadata.get("duplicate_sources", [])
+
+        report = DedupReport(
+            documents=len(docs),
+            removed_documents=len(docs) - len(kept),
+            removed_passages=removed_passages,
+            removed_chars=removed_chars,
+        )
+        dedup_span.set(removed_documents=report.removed_documents, removed_passages=report.removed_passages,
+                       removed_chars=report.removed_chars)
+    telemetry.observe("dedup_removed_chars", report.removed_chars)
+    return kept, report
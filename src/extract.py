@@ -0,0 +1,155 @@
+import os
+import re
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, Union
+from lxml import etree
+from lxml import html as lxml_html
+from langchain.docstore.document import Document
+from dedup import DEDUP_ENABLED, clean_text
+
+# HTML-to-text extraction: lxml parse, drop non-content subtrees, keep the main content block.
+# <form> is kept: ASP.NET WebForms pages wrap the whole body in one; its controls are dropped instead.
+DROP_TAGS = (
+    "script", "style", "noscript", "template", "svg", "iframe", "canvas",
+    "nav", "footer", "aside", "button", "select", "textarea",
+)
+MAIN_CANDIDATES = './/main | .//article | .//*[@role="main"]'
+MIN_MAIN_CHARS = 200
+MIN_MAIN_SHARE = 0.3
+# Bodies are parsed in chunks and dropped subtrees are emptied as soon as they close
+PARSE_CHUNK_BYTES = 64 * 1024
+
+# Pages are spread over a process pool once there are enough of them to pay for the IPC
+PROCESS_POOL_MIN_PAGES = int(os.getenv("EXTRACT_POOL_MIN_PAGES", 4))
+PROCESS_POOL_MIN_BYTES = int(os.getenv("EXTRACT_POOL_MIN_BYTES", 512 * 1024))
+PROCESS_POOL_WORKERS = int(os.getenv("EXTRACT_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+
+SPECIAL_CHARACTERS = re.compile(r'[^\w\s.,?!()/;-]+')
+
+# Same output as the old regex passes: drop special characters, then collapse whitespace with str.split
+def normalize_text(text: str) -> str:
+    return " ".join(SPECIAL_CHARACTERS.sub('', text).split())
+
+# Incremental parse: scripts, styles and the other DROP_TAGS are emptied while the rest of the page is
+# still arriving, so the tree never holds them whole. Bytes are decoded with the charset from the
+# response headers, UTF-8 by default.
+def parse_html(html: Union[str, bytes], encoding: Optional[str] = None):
+    if isinstance(html, str):
+        # Encoding to bytes avoids lxml rejecting str input that carries an XML encoding declaration
+        html, encoding = html.encode("utf-8", "replace"), "utf-8"
+    parser = etree.HTMLPullParser(
+        events=("end",), tag=DROP_TAGS, encoding=encoding or "utf-8", remove_comments=True, remove_pis=True
+    )
+    parser.set_element_class_lookup(lxml_html.HtmlElementClassLookup())
+    for start in range(0, len(html), PARSE_CHUNK_BYTES):
+        parser.feed(html[start:start + PARSE_CHUNK_BYTES])
+        for _, element in parser.read_events():
+            # Removing the element here would misplace the text that follows it, the empty shell goes later
+            element.clear(keep_tail=True)
+    root = parser.close()
+    etree.strip_elements(root, *DROP_TAGS, with_tail=False)
+    return root
+
+def first(values: list) -> Optional[str]:
+    for value in values:
+        value = value.strip()
+        if value:
+            return value
+    return None
+
+def extract_metadata(root, url: str) -> dict:
+    metadata = {"source": url}
+    title = first(root.xpath('//title/text()')) or first(root.xpath('//meta[@property="og:title"]/@content'))
+    if title:
+        metadata["title"] = title
+    description = (
+        first(root.xpath('//meta[@name="description"]/@content'))
+        or first(root.xpath('//meta[@property="og:description"]/@content'))
+    )
+    if description:
+        metadata["description"] = description
+    metadata["language"] = root.get("lang", "No language found.")
+    return metadata
+
+def text_length(node) -> int:
+    return len(node.text_content().strip())
+
+# <main>/<article> when one clearly holds the page's content, otherwise the whole body
+def main_block(root):
+    body = root.find("body")
+    if body is None:
+        body = root
+    best = max(body.xpath(MAIN_CANDIDATES), key=text_length, default=None)
+    if best is not None:
+        best_length = text_length(best)
+        if best_length >= MIN_MAIN_CHARS and best_length >= MIN_MAIN_SHARE * text_length(body):
+            return best
+    return body
+
+def extract_text(url: str, html: Union[str, bytes], encoding: Optional[str] = None) -> Tuple[str, dict]:
+    if not html.strip():
+        return "", {"source": url}
+    try:
+        # Non-content subtrees are gone before any text is built
+        root = parse_html(html, encoding)
+    except (etree.ParserError, etree.XMLSyntaxError, LookupError, ValueError):
+        return "", {"source": url}
+    metadata = extract_metadata(root, url)
+    text = normalize_text(" ".join(main_block(root).itertext()))
+    if DEDUP_ENABLED:
+        # Repeated passages go here, in the pool; the fingerprint is cached with the page for dedup
+        cleaned, metadata["simhash"], metadata["removed_passages"] = clean_text(text)
+        metadata["removed_chars"] = len(text) - len(cleaned)
+        text = cleaned
+    return text, metadata
+
+def extract_document(url: str, html: Union[str, bytes], encoding: Optional[str] = None) -> Document:
+    text, metadata = extract_text(url, html, encoding)
+    return Document(page_content=text, metadata=metadata)
+
+# Pages are (url, html) or (url, body bytes, encoding) tuples
+def _extract_all(pages: List[tuple]) -> List[Tuple[str, dict]]:
+    return [extract_text(*page) for page in pages]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Workers re-run the main script's module-level code, so entry points keep heavy setup (the Gradio UI)
+# under `if __name__ == "__main__"`
+def get_process_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver avoids forking a process that already runs the fetch loop and Gradio threads;
+            # the server imports this module once and every worker is forked with it loaded
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["extract"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=context)
+    return _pool
+
+# Start the workers ahead of the first large batch, so it does not wait for them to import lxml
+def start_process_pool():
+    if PROCESS_POOL_WORKERS > 1:
+        pool = get_process_pool()
+        for _ in range(PROCESS_POOL_WORKERS):
+            pool.submit(_extract_all, [])
+
+def extract_pages(pages: List[tuple], parallel: Optional[bool] = None) -> List[Document]:
+    if parallel is None:
+        parallel = (
+            PROCESS_POOL_WORKERS > 1
+            and len(pages) >= PROCESS_POOL_MIN_PAGES
+            and sum(len(page[1]) for page in pages) >= PROCESS_POOL_MIN_BYTES
+        )
+    if parallel:
+        # Small batches per task keep the pool busy while the largest page is still parsing
+        batches = [pages[start:start + 2] for start in range(0, len(pages), 2)]
+        results = [result for batch in get_process_pool().map(_extract_all, batches) for result in batch]
+    else:
+        results = _extract_all(pages)
+    return [Document(page_content=text, metadata=metadata) for text, metadata in results]
@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from context_builder import estimate_tokens
+from core import gemini
+import telemetry
+
+# Token-bounded conversation history: the last turns stay verbatim, older ones are folded into a summary
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", 6))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 6000))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 800))
+SUMMARY_MODEL_NAME = os.getenv("SUMMARY_MODEL_NAME", "models/gemini-1.5-flash-8b")
+EXCERPT_CHARS = 300
+
+Turn = Tuple[str, str]
+Summarizer = Callable[[str, List[Turn], int], str]
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an assistant.
+Keep the facts, numbers, names and open questions the assistant may need later; drop pleasantries.
+Write in the language of the conversation, in at most {words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+def format_turns(turns: List[Turn]) -> str:
+    return "\n".join(f"User: {user}\nAssistant: {model}" for user, model in turns)
+
+def gemini_summarizer(summary: str, turns: List[Turn], budget: int) -> str:
+    model = gemini().GenerativeModel(SUMMARY_MODEL_NAME)
+    prompt = SUMMARY_PROMPT.format(words=budget * 3 // 4, summary=summary or "(empty)", turns=format_turns(turns))
+    response = model.generate_content(prompt, generation_config={"max_output_tokens": budget, "temperature": 0.2})
+    return response.text.strip()
+
+# Used when the summary model fails: short excerpts of each folded turn
+def excerpt_summarizer(summary: str, turns: List[Turn], budget: int) -> str:
+    lines = [summary] if summary else []
+    lines += [f"User asked: {user[:EXCERPT_CHARS]} / Assistant: {model[:EXCERPT_CHARS]}" for user, model in turns]
+    return "\n".join(lines)
+
+def fit_budget(text: str, budget: int) -> str:
+    # Keep the most recent part of the summary when it grows past its budget
+    max_chars = budget * 4
+    return text if len(text) <= max_chars else text[-max_chars:]
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+class ChatHistory:
+    def __init__(self, recent_turns: int = HISTORY_RECENT_TURNS, token_budget: int = HISTORY_TOKEN_BUDGET,
+                 summary_budget: int = SUMMARY_TOKEN_BUDGET, summarizer: Optional[Summarizer] = gemini_summarizer):
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summarizer = summarizer
+        self.summary = ""
+        self._turns = deque()  # (user, model, tokens)
+        self._recent_tokens = 0
+        # Turns waiting to be summarized, keyed by sequence number so a fold running in the
+        # background removes exactly the turns it summarized even if older ones were dropped meanwhile
+        self._pending: Dict[int, Turn] = {}
+        self._next_seq = 0
+        self._summarizing = False
+        self._lock = threading.Lock()
+        self.prompt_tokens: List[int] = []
+
+    def __len__(self):
+        return len(self._turns)
+
+    # Contents for the next generate_content call: summary, pending and recent turns, then the new message
+    def build(self, message: str) -> List[dict]:
+        with self._lock:
+            contents = []
+            background = self.summary
+            if self._pending:
+                background = "\n".join(filter(None, [background, format_turns(list(self._pending.values()))]))
+            if background:
+                contents.append({"role": "user", "parts": [f"Summary of our earlier conversation:\n{background}"]})
+                contents.append({"role": "model", "parts": ["Understood."]})
+            for user, model, _ in self._turns:
+                contents.append({"role": "user", "parts": [user]})
+                contents.append({"role": "model", "parts": [model]})
+            contents.append({"role": "user", "parts": [message]})
+            tokens = estimate_tokens(background) + self._recent_tokens + estimate_tokens(message)
+            self.prompt_tokens.append(tokens)
+        telemetry.observe("history_tokens", tokens)
+        return contents
+
+    def add_turn(self, message: str, answer: str):
+        with self._lock:
+            tokens = estimate_tokens(message) + estimate_tokens(answer)
+            self._turns.append((message, answer, tokens))
+            self._recent_tokens += tokens
+            while len(self._turns) > 1 and (
+                len(self._turns) > self.recent_turns or self._recent_tokens > self.token_budget
+            ):
+                user, model, turn_tokens = self._turns.popleft()
+                self._recent_tokens -= turn_tokens
+                self._pending[self._next_seq] = (user, model)
+                self._next_seq += 1
+            # If summarization falls behind, the oldest pending turns are dropped to keep the prompt bounded.
+            # Like the recent window, which never goes below one turn, at least one turn stays pending.
+            limit = max(self.recent_turns, 1)
+            for seq in list(self._pending)[:-limit]:
+                del self._pending[seq]
+            start = bool(self._pending) and not self._summarizing
+            if start:
+                self._summarizing = True
+        if start:
+            _executor.submit(self._fold)
+
+    # Runs in the background: folds pending turns into the summary until none are left
+    def _fold(self):
+        while True:
+            with self._lock:
+                seqs = list(self._pending)
+                turns = list(self._pending.values())
+                summary = self.summary
+                if not turns:
+                    self._summarizing = False
+                    return
+            with telemetry.span("summarize", turns=len(turns)):
+                try:
+                    if self.summarizer is None:
+                        raise RuntimeError("no summarizer configured")
+                    updated = self.summarizer(summary, turns, self.summary_budget)
+                except Exception:
+                    updated = excerpt_summarizer(summary, turns, self.summary_budget)
+            with self._lock:
+                self.summary = fit_budget(updated, self.summary_budget)
+                # Turns added while the summary was being written stay pending for the next round;
+                # folded turns that add_turn already dropped are simply gone
+                for seq in seqs:
+                    self._pending.pop(seq, None)
+
+    @property
+    def last_prompt_tokens(self) -> int:
+        return self.prompt_tokens[-1] if self.prompt_tokens else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "recent_turns": len(self._turns),
+                "recent_tokens": self._recent_tokens,
+                "pending_turns": len(self._pending),
+                "summary_tokens": estimate_tokens(self.summary),
+                "last_prompt_tokens": self.last_prompt_tokens,
+            }
@@ -0,0 +1,194 @@
+import os
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from db import thread_connection
+
+# Persistent per-host scoreboard: fetch latency, failure rate and extracted text yield, kept as
+# moving averages in SQLite next to the page cache so every app worker learns from the others.
+# Updates are queued and written in batches by one background thread, so a caller on the event loop
+# never waits on SQLite; reads see them once written.
+HOST_SCORES_PATH = os.getenv(
+    "HOST_SCORES_PATH", os.path.join(os.path.dirname(__file__), "../.cache/hosts.sqlite3")
+)
+HOST_SCORES_ENABLED = os.getenv("HOST_SCORES_ENABLED", "1") != "0"
+SMOOTHING = 0.3
+# A host is tried last once it looks unreliable, slow or keeps returning little text
+POOR_FAILURE_RATE = 0.5
+SLOW_SECONDS = float(os.getenv("HOST_SLOW_SECONDS", 3.0))
+MIN_YIELD_CHARS = 300
+# After this many failures in a row a host is skipped, for a period that doubles with every further failure
+SKIP_AFTER_FAILURES = 3
+SKIP_SECONDS = 600
+MAX_SKIP_SECONDS = 24 * 3600
+# Responses that say the host is blocking, throttling or broken; a 404 only says one URL went stale
+HOST_ERROR_STATUSES = (403, 429)
+
+TIER_HEALTHY = 0
+TIER_POOR = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    consecutive_failures INTEGER NOT NULL,
+    latency REAL NOT NULL,
+    failure_rate REAL NOT NULL,
+    yield_chars REAL,
+    skip_until REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+@dataclass
+class HostStats:
+    host: str
+    attempts: int
+    failures: int
+    consecutive_failures: int
+    latency: float
+    failure_rate: float
+    yield_chars: Optional[float]
+    skip_until: float
+
+    @property
+    def skipped(self) -> bool:
+        return self.skip_until > time.time()
+
+    @property
+    def tier(self) -> int:
+        poor = (
+            self.failure_rate >= POOR_FAILURE_RATE
+            or self.latency >= SLOW_SECONDS
+            or (self.yield_chars is not None and self.yield_chars < MIN_YIELD_CHARS)
+        )
+        return TIER_POOR if poor else TIER_HEALTHY
+
+# A fetch fails the host on a transport error or timeout (no status), a block, throttling or a server error
+def host_failed(status: Optional[int]) -> bool:
+    return status is None or status in HOST_ERROR_STATUSES or status >= 500
+
+def moving_average(previous: Optional[float], value: float) -> float:
+    return value if previous is None else previous + SMOOTHING * (value - previous)
+
+class HostScoreboard:
+    def __init__(self, path: str = HOST_SCORES_PATH):
+        self.path = path
+        self._connection = thread_connection(path)
+        self._pending: List[Tuple[str, Callable[[HostStats, bool], None]]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="host-scores")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def get(self, hosts: Iterable[str]) -> Dict[str, HostStats]:
+        hosts = list(set(hosts))
+        if not hosts:
+            return {}
+        rows = self._connection().execute(
+            "SELECT host, attempts, failures, consecutive_failures, latency, failure_rate, yield_chars, skip_until "
+            f"FROM hosts WHERE host IN ({','.join('?' * len(hosts))})", hosts
+        ).fetchall()
+        return {row[0]: HostStats(*row) for row in rows}
+
+    def _update(self, host: str, update: Callable[[HostStats, bool], None]):
+        with self._pending_lock:
+            self._pending.append((host, update))
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._writer.submit(self._write_pending)
+
+    # Runs on the writer thread: every queued update in one transaction
+    def _write_pending(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+            self._flush_scheduled = False
+        if not batch:
+            return
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                scores = self.get(host for host, _ in batch)
+                for host, update in batch:
+                    stats = scores.setdefault(host, HostStats(host, 0, 0, 0, 0.0, 0.0, None, 0.0))
+                    update(stats, stats.attempts == 0)
+                now = time.time()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO hosts (host, attempts, failures, consecutive_failures, latency, "
+                    "failure_rate, yield_chars, skip_until, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(stats.host, stats.attempts, stats.failures, stats.consecutive_failures, stats.latency,
+                      stats.failure_rate, stats.yield_chars, stats.skip_until, now) for stats in scores.values()],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print(f"Failed to save host scores: {e}")
+
+    # Wait until every update queued so far is written
+    def flush(self):
+        self._writer.submit(self._write_pending).result()
+
+    def record_fetch(self, host: str, seconds: float, ok: bool):
+        def update(stats: HostStats, first: bool):
+            stats.attempts += 1
+            stats.latency = moving_average(None if first else stats.latency, seconds)
+            stats.failure_rate = moving_average(None if first else stats.failure_rate, 0.0 if ok else 1.0)
+            if ok:
+                stats.consecutive_failures = 0
+                return
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= SKIP_AFTER_FAILURES:
+                backoff = SKIP_SECONDS * 2 ** (stats.consecutive_failures - SKIP_AFTER_FAILURES)
+                stats.skip_until = time.time() + min(backoff, MAX_SKIP_SECONDS)
+        self._update(host, update)
+
+    # A fetch cancelled before it finished only tells that the host takes at least this long; it does
+    # not count as an attempt, so losing the race to faster hosts never leads to a skip
+    def record_latency(self, host: str, seconds: float):
+        def update(stats: HostStats, first: bool):
+            if first or seconds > stats.latency:
+                stats.latency = moving_average(None if first else stats.latency, seconds)
+        self._update(host, update)
+
+    # Characters of text the page produced after extraction; near-empty pages (bot walls, JS shells) score low
+    def record_yield(self, host: str, chars: int):
+        def update(stats: HostStats, first: bool):
+            stats.yield_chars = moving_average(stats.yield_chars, chars)
+        self._update(host, update)
+
+    def stats(self) -> dict:
+        self.flush()
+        hosts, skipped, failure_rate, latency = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(skip_until > ?), 0), COALESCE(AVG(failure_rate), 0), COALESCE(AVG(latency), 0) "
+            "FROM hosts", (time.time(),)
+        ).fetchone()
+        return {"hosts": hosts, "skipped": skipped, "avg_failure_rate": failure_rate, "avg_latency": latency}
+
+    def clear(self):
+        def clear():
+            with self._pending_lock:
+                self._pending = []
+            self._connection().execute("DELETE FROM hosts")
+        self._writer.submit(clear).result()
+
+_scoreboard = None
+_scoreboard_lock = threading.Lock()
+
+def get_host_scoreboard() -> Optional[HostScoreboard]:
+    global _scoreboard
+    if not HOST_SCORES_ENABLED:
+        return None
+    with _scoreboard_lock:
+        if _scoreboard is None:
+            _scoreboard = HostScoreboard()
+    return _scoreboard
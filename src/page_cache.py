@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from db import thread_connection
+
+# Shared on-disk page cache. SQLite in WAL mode lets several app workers read and write the same file.
+# Only the extracted text is stored: the raw HTML is never needed again once a page is parsed.
+PAGE_CACHE_PATH = os.getenv(
+    "PAGE_CACHE_PATH", os.path.join(os.path.dirname(__file__), "../.cache/pages.sqlite3")
+)
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 3600))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") != "0"
+# Lookups only touch memory: hit/miss counters and access times are written in one transaction with the
+# next store, or after this many lookups
+PENDING_FLUSH_LOOKUPS = 64
+# Bumped when the pages table changes shape; an older cache file is emptied and recreated
+SCHEMA_VERSION = 2
+
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|mc_cid|mc_eid)$', re.IGNORECASE)
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not TRACKING_PARAMS.match(name)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+def ttl_from_headers(headers, default: int = PAGE_CACHE_TTL) -> Optional[int]:
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    match = MAX_AGE.search(cache_control)
+    if match:
+        return min(int(match.group(1)), default)
+    return default
+
+@dataclass
+class CachedPage:
+    url: str
+    text: str
+    metadata: dict
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class PageCache:
+    def __init__(self, path: str = PAGE_CACHE_PATH, ttl: int = PAGE_CACHE_TTL, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._connection = thread_connection(path)
+        self._pending_lock = threading.Lock()
+        self._pending_counts: Dict[str, int] = {}
+        self._pending_access: Dict[str, float] = {}
+        self._pending_lookups = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS pages")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.executescript(SCHEMA)
+
+    def _count(self, conn: sqlite3.Connection, name: str, amount: int = 1):
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def _add_count(self, name: str, amount: int = 1):
+        with self._pending_lock:
+            self._pending_counts[name] = self._pending_counts.get(name, 0) + amount
+
+    # Counters and access times gathered since the last flush, inside the caller's transaction
+    def _write_pending(self, conn: sqlite3.Connection):
+        with self._pending_lock:
+            counts, self._pending_counts = self._pending_counts, {}
+            accessed, self._pending_access = self._pending_access, {}
+            self._pending_lookups = 0
+        conn.executemany(
+            "UPDATE pages SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+            ((accessed_at, key) for key, accessed_at in accessed.items()),
+        )
+        for name, amount in counts.items():
+            self._count(conn, name, amount)
+
+    def _transaction(self, work):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            work(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def flush(self):
+        with self._pending_lock:
+            if not self._pending_counts and not self._pending_access:
+                return
+        self._transaction(self._write_pending)
+
+    # Blocking; call it from a thread, not from the event loop
+    def get(self, url: str) -> Optional[CachedPage]:
+        key = normalize_url(url)
+        row = self._connection().execute(
+            "SELECT text, metadata, etag, last_modified, expires_at FROM pages WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self._pending_lock:
+            self._pending_access[key] = time.time()
+            self._pending_lookups += 1
+            due = self._pending_lookups >= PENDING_FLUSH_LOOKUPS
+        if due:
+            self.flush()
+        text, metadata, etag, last_modified, expires_at = row
+        return CachedPage(url, text, json.loads(metadata), etag, last_modified, expires_at)
+
+    def put(self, url: str, text: str, metadata: dict, etag: Optional[str] = None,
+            last_modified: Optional[str] = None, ttl: Optional[int] = None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        metadata = json.dumps(metadata)
+        size = len(text.encode()) + len(metadata)
+        if size > self.max_bytes:
+            return
+        def store(conn: sqlite3.Connection):
+            self._write_pending(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(key, text, metadata, etag, last_modified, fetched_at, expires_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), text, metadata, etag, last_modified, now, now + ttl, now, size),
+            )
+            self._count(conn, "stores")
+            self._evict(conn)
+        self._transaction(store)
+
+    # A 304 keeps the stored body and text, only the freshness window moves
+    def refresh(self, url: str, ttl: Optional[int] = None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        self._connection().execute(
+            "UPDATE pages SET expires_at = ?, accessed_at = ? WHERE key = ?", (now + ttl, now, normalize_url(url))
+        )
+
+    # Least recently used entries go first once the cache is over its size bound
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM pages ORDER BY accessed_at"):
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM pages WHERE key = ?", evicted)
+        self._count(conn, "evictions", len(evicted))
+
+    def record_hit(self):
+        self._add_count("hits")
+
+    def record_miss(self):
+        self._add_count("misses")
+
+    def record_revalidated(self):
+        self._add_count("revalidated")
+
+    def stats(self) -> dict:
+        self.flush()
+        conn = self._connection()
+        stats = {"hits": 0, "misses": 0, "revalidated": 0, "stores": 0, "evictions": 0}
+        stats.update(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        stats["entries"] = entries
+        stats["bytes"] = size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._pending_lock:
+            self._pending_counts, self._pending_access, self._pending_lookups = {}, {}, 0
+        conn = self._connection()
+        conn.execute("DELETE FROM pages")
+        conn.execute("DELETE FROM stats")
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+def get_page_cache() -> Optional[PageCache]:
+    global _page_cache
+    if not PAGE_CACHE_ENABLED:
+        return None
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache()
+    return _page_cache
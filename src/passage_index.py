@@ -0,0 +1,341 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+from context_builder import split_passages, term_hashes
+from search_cache import SEARCH_CACHE_TTL_TIME_SENSITIVE, is_time_sensitive
+import telemetry
+from db import thread_connection
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, one process per index
+    fcntl = None
+
+# Local passage index: every page search_google returns is split into passages, embedded on the CPU as
+# a hashed TF-IDF vector and stored in a memory-mapped matrix, with the passage text in SQLite next to
+# it. A query whose terms are well covered by the best passages is answered from the index, without a
+# Custom Search call or any downloads.
+# Weighting follows the SMART lnc.ltc scheme: passage vectors are log tf, cosine normalized and stored
+# once; idf is applied to the query only, so scoring a query reads just the columns of its terms.
+# SQLite is the record of which slot holds what; the matrices are written after each transaction commits.
+# Every worker maps the same files, so a writer holds a lock file from before its transaction until the
+# matrices reflect it: updates land in commit order and df is never read-modified-written concurrently.
+PASSAGE_INDEX_PATH = os.getenv("PASSAGE_INDEX_PATH", os.path.join(os.path.dirname(__file__), "../.cache/index"))
+PASSAGE_INDEX_ENABLED = os.getenv("PASSAGE_INDEX_ENABLED", "1") != "0"
+PASSAGE_INDEX_TTL = int(os.getenv("PASSAGE_INDEX_TTL", 24 * 3600))
+PASSAGE_INDEX_MAX_PASSAGES = int(os.getenv("PASSAGE_INDEX_MAX_PASSAGES", 200_000))
+INDEX_DIM = 1024
+# Bumped whenever stored vectors change meaning (term hashing, weighting); an index of another version is cleared
+INDEX_VERSION = 2
+SEARCH_BLOCK_ROWS = 32768
+# A query is answered from the index when its best passages score well, come from enough pages and
+# contain most of its terms (weighted by idf)
+CANDIDATE_PASSAGES = 256
+MIN_SCORE = 0.2
+MIN_PAGES = 3
+MIN_COVERAGE = float(os.getenv("PASSAGE_INDEX_MIN_COVERAGE", 0.8))
+
+# Slots are rows of the matrices; a slot with expires_at 0 is free
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS passages (
+    slot INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS passages_source ON passages (source);
+CREATE INDEX IF NOT EXISTS passages_expires_at ON passages (expires_at);
+CREATE TABLE IF NOT EXISTS pages (
+    source TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL,
+    checksum INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def term_columns(hashes: np.ndarray) -> np.ndarray:
+    return (hashes % np.uint64(INDEX_DIM)).astype(np.int64)
+
+def checksum(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+# Log tf vectors of the texts, one row each; columns are hashed terms. Rows are cosine normalized
+# unless idf weights are given (query side), in which case they are applied before normalizing.
+def embed(texts: List[str], lan: str = 'en', idf: Optional[np.ndarray] = None) -> np.ndarray:
+    hashes, rows = term_hashes(texts, lan)
+    counts = np.bincount(rows * INDEX_DIM + term_columns(hashes), minlength=len(texts) * INDEX_DIM)
+    counts = counts.reshape(len(texts), INDEX_DIM).astype(np.float32)
+    vectors = np.where(counts > 0, 1 + np.log(np.maximum(counts, 1)), 0).astype(np.float32)
+    if idf is not None:
+        vectors *= idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+class PassageIndex:
+    def __init__(self, path: str = PASSAGE_INDEX_PATH, max_passages: int = PASSAGE_INDEX_MAX_PASSAGES,
+                 ttl: int = PASSAGE_INDEX_TTL):
+        self.path = path
+        self.max_passages = max_passages
+        self.ttl = ttl
+        self._connection = thread_connection(os.path.join(path, "passages.sqlite3"))
+        os.makedirs(path, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+        # Files are preallocated sparse, so unused slots take no disk space; every worker maps the same files
+        self._vectors = self._map("vectors.f16", np.float16, (max_passages, INDEX_DIM))
+        self._expires = self._map("expires.f64", np.float64, (max_passages,))
+        self._indexed = self._map("indexed.f64", np.float64, (max_passages,))
+        self._df = self._map("df.i64", np.int64, (INDEX_DIM,))
+        version = self._connection().execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if version is None or version[0] != INDEX_VERSION:
+            self.clear()
+
+    def _map(self, name: str, dtype, shape: tuple) -> np.memmap:
+        path = os.path.join(self.path, name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        with open(os.path.join(self.path, "write.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _used(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM meta WHERE name = 'used'").fetchone()
+        return row[0] if row else 0
+
+    # Slots below `used` that no passage row holds. Read from SQLite rather than from the matrices, which
+    # another process may not have updated yet after its commit.
+    def _free_slots(self, conn: sqlite3.Connection, used: int) -> np.ndarray:
+        taken = np.fromiter((slot for (slot,) in conn.execute("SELECT slot FROM passages")), dtype=np.int64)
+        return np.setdiff1d(np.arange(used), taken)
+
+    # Applied once the transaction that freed the slots has committed
+    def _release(self, slots: np.ndarray):
+        if not len(slots):
+            return
+        self._df -= (self._vectors[slots] > 0).sum(axis=0)
+        self._expires[slots] = 0
+
+    # Pages already indexed with the same text are skipped, which is the common case for pages served
+    # from the page cache
+    def _changed(self, docs: List[Document]) -> List[Document]:
+        sources = [doc.metadata.get("source", "N/A") for doc in docs]
+        if not sources:
+            return []
+        indexed = dict(self._connection().execute(
+            f"SELECT source, checksum FROM pages WHERE source IN ({','.join('?' * len(sources))}) "
+            "AND EXISTS (SELECT 1 FROM passages WHERE passages.source = pages.source AND expires_at > ?)",
+            sources + [time.time()],
+        ).fetchall())
+        return [doc for source, doc in zip(sources, docs) if indexed.get(source) != checksum(doc.page_content)]
+
+    def add(self, docs: List[Document], lan: str = 'en'):
+        docs = self._changed(docs)
+        passages = [
+            (doc.metadata.get("source", "N/A"), passage)
+            for index, doc in enumerate(docs) for passage in split_passages(index, doc.page_content)
+        ][:self.max_passages]
+        if not passages:
+            return
+        with telemetry.span("index_add", documents=len(docs), passages=len(passages)):
+            vectors = embed([passage.text for _, passage in passages], lan)
+            with self._write_lock():
+                slots, freed, now = self._store(docs, passages)
+                # Only a committed transaction reaches the matrices, so a rollback leaves them matching SQLite
+                self._release(freed)
+                self._vectors[slots] = vectors
+                self._expires[slots] = now + self.ttl
+                self._indexed[slots] = now
+                self._df += (vectors > 0).sum(axis=0)
+                for memmap in (self._vectors, self._expires, self._indexed, self._df):
+                    memmap.flush()
+
+    # Expired passages and earlier copies of the same pages are freed first; when the index is full the
+    # passages closest to expiry make room. Returns the slots the passages went to, the slots freed and
+    # the time they were stored, once committed.
+    def _store(self, docs: List[Document], passages: list) -> Tuple[np.ndarray, np.ndarray, float]:
+        sources = list(dict.fromkeys(source for source, _ in passages))
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            stale = {slot for (slot,) in conn.execute("SELECT slot FROM passages WHERE expires_at <= ?", (now,))}
+            stale.update(
+                slot for source in sources
+                for (slot,) in conn.execute("SELECT slot FROM passages WHERE source = ?", (source,))
+            )
+            conn.executemany("DELETE FROM passages WHERE slot = ?", ((slot,) for slot in stale))
+
+            used = self._used(conn)
+            slots = self._free_slots(conn, used)[:len(passages)].tolist()
+            fresh = min(len(passages) - len(slots), self.max_passages - used)
+            slots += range(used, used + fresh)
+            evicted = []
+            if len(slots) < len(passages):
+                evicted = [slot for (slot,) in conn.execute(
+                    "SELECT slot FROM passages ORDER BY expires_at LIMIT ?", (len(passages) - len(slots),)
+                )]
+                conn.executemany("DELETE FROM passages WHERE slot = ?", ((slot,) for slot in evicted))
+                slots += evicted
+
+            slots = np.array(slots)
+            conn.executemany(
+                "INSERT INTO passages (slot, source, position, text, expires_at) VALUES (?, ?, ?, ?, ?)",
+                ((int(slot), source, passage.position, passage.text, now + self.ttl)
+                 for slot, (source, passage) in zip(slots, passages)),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO pages (source, metadata, checksum) VALUES (?, ?, ?)",
+                ((doc.metadata.get("source", "N/A"), json.dumps(doc.metadata), checksum(doc.page_content))
+                 for doc in docs),
+            )
+            conn.execute("DELETE FROM pages WHERE source NOT IN (SELECT source FROM passages)")
+            conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('used', ?)", (used + fresh,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return slots, np.array(sorted(stale.union(evicted)), dtype=np.int64), now
+
+    def idf(self, used: int) -> np.ndarray:
+        total = np.count_nonzero(self._expires[:used])
+        return (np.log((1 + total) / (1 + np.maximum(self._df, 0))) + 1).astype(np.float32)
+
+    # Brute-force cosine over every live slot, block by block, then the top `count` with argpartition.
+    # Returns (slot, score) pairs, best first; max_age (seconds) skips passages indexed earlier.
+    def search(self, query: str, lan: str = 'en', count: int = CANDIDATE_PASSAGES,
+               max_age: Optional[float] = None) -> List[tuple]:
+        used = self._used(self._connection())
+        if not used:
+            return []
+        query_vector = embed([query], lan, self.idf(used))[0]
+        columns = np.flatnonzero(query_vector)
+        if not len(columns):
+            return []
+        now = time.time()
+        scores = np.empty(used, dtype=np.float32)
+        for start in range(0, used, SEARCH_BLOCK_ROWS):
+            block = self._vectors[start:min(start + SEARCH_BLOCK_ROWS, used)]
+            scores[start:start + len(block)] = block[:, columns].astype(np.float32) @ query_vector[columns]
+        live = self._expires[:used] > now
+        if max_age is not None:
+            live &= self._indexed[:used] >= now - max_age
+        scores[~live] = 0
+        count = min(count, used)
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(slot), float(scores[slot])) for slot in top if scores[slot] > 0]
+
+    # Documents rebuilt from the best passages of the best pages, or None when the index does not cover
+    # the query well enough and a live search is needed
+    def lookup(self, query: str, topk: int = 3, lan: str = 'en') -> Optional[List[Document]]:
+        max_age = SEARCH_CACHE_TTL_TIME_SENSITIVE if is_time_sensitive(query) else None
+        with telemetry.span("index_lookup", query=query) as lookup_span:
+            hits = self.search(query, lan, max_age=max_age)
+            docs = self._documents(query, hits, topk, lan) if hits and hits[0][1] >= MIN_SCORE else None
+            lookup_span.set(hit=docs is not None, candidates=len(hits))
+        telemetry.cache_lookup("index", hit=docs is not None)
+        return docs
+
+    def _documents(self, query: str, hits: List[tuple], topk: int, lan: str) -> Optional[List[Document]]:
+        conn = self._connection()
+        scores = dict(hits)
+        rows = conn.execute(
+            f"SELECT slot, source, position, text FROM passages WHERE slot IN ({','.join('?' * len(hits))}) "
+            "AND expires_at > ?", [slot for slot, _ in hits] + [time.time()]
+        ).fetchall()
+        pages: Dict[str, list] = {}
+        for slot, source, position, text in sorted(rows, key=lambda row: -scores[row[0]]):
+            pages.setdefault(source, []).append((position, text))
+        if len(pages) < min(topk, MIN_PAGES):
+            return None
+        sources = list(pages)[:topk]
+
+        # Share of the query's terms, weighted by idf, that appear in the kept passages
+        terms = np.unique(term_hashes([query], lan)[0])
+        found = np.isin(terms, term_hashes([text for source in sources for _, text in pages[source]], lan)[0])
+        weights = self.idf(self._used(conn))[term_columns(terms)]
+        coverage = weights[found].sum() / max(weights.sum(), 1e-9)
+        if coverage < MIN_COVERAGE:
+            return None
+
+        metadata = dict(conn.execute(
+            f"SELECT source, metadata FROM pages WHERE source IN ({','.join('?' * len(sources))})", sources
+        ).fetchall())
+        return [
+            Document(
+                page_content=" ".join(text for _, text in sorted(pages[source])),
+                metadata=json.loads(metadata.get(source, "{}")) or {"source": source},
+            )
+            for source in sources
+        ]
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        passages, pages = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT source) FROM passages WHERE expires_at > ?", (time.time(),)
+        ).fetchone()
+        return {"passages": passages, "pages": pages, "slots_used": self._used(conn)}
+
+    def clear(self):
+        with self._write_lock():
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM passages")
+                conn.execute("DELETE FROM pages")
+                conn.execute("DELETE FROM meta")
+                conn.execute("INSERT INTO meta (name, value) VALUES ('version', ?)", (INDEX_VERSION,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._expires[:] = 0
+            self._df[:] = 0
+
+_index = None
+_index_lock = threading.Lock()
+# Indexing runs in the background, after the search that fetched the pages has returned
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="passage-index")
+
+def get_passage_index() -> Optional[PassageIndex]:
+    global _index
+    if not PASSAGE_INDEX_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = PassageIndex()
+    return _index
+
+def _add(index: PassageIndex, docs: List[Document], lan: str):
+    try:
+        index.add(docs, lan)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Passage index: could not add {len(docs)} documents ({e})")
+
+def index_documents(docs: List[Document], lan: str = 'en'):
+    index = get_passage_index()
+    if index is not None and docs:
+        _executor.submit(_add, index, docs, lan)
+
+# Blocks until the documents handed to index_documents so far are indexed
+def wait_for_indexing():
+    _executor.submit(lambda: None).result()
@@ -0,0 +1,100 @@
+import os
+import time
+import random
+import asyncio
+import functools
+import threading
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+import httpx
+
+# Named token buckets for outbound calls ("cse", "fetch", "gemini") and retry with backoff.
+# Nothing is limited until configure() sets a rate, so the interactive apps are unaffected.
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", 1))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+# Tokens are reserved under a lock and the caller sleeps off any debt, so a bucket can be
+# shared by several event loops and threads
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    async def acquire(self, tokens: float = 1):
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+_buckets: Dict[str, TokenBucket] = {}
+_retry_attempts = RETRY_ATTEMPTS
+
+# Rates are in calls per second; a rate of None or 0 removes the limit
+def configure(retry_attempts: Optional[int] = None, **rates: Optional[float]):
+    global _retry_attempts
+    if retry_attempts is not None:
+        _retry_attempts = max(1, retry_attempts)
+    for name, rate in rates.items():
+        if rate:
+            _buckets[name] = TokenBucket(rate)
+        else:
+            _buckets.pop(name, None)
+
+def retry_attempts() -> int:
+    return _retry_attempts
+
+async def acquire(name: str):
+    bucket = _buckets.get(name)
+    if bucket is not None:
+        await bucket.acquire()
+
+# Gemini errors worth retrying; google.api_core is only imported once an error needs classifying
+@functools.lru_cache(maxsize=None)
+def retry_exceptions() -> tuple:
+    from google.api_core import exceptions
+    return (
+        exceptions.TooManyRequests,
+        exceptions.ResourceExhausted,
+        exceptions.InternalServerError,
+        exceptions.BadGateway,
+        exceptions.ServiceUnavailable,
+        exceptions.GatewayTimeout,
+        exceptions.DeadlineExceeded,
+    )
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (httpx.TransportError,) + retry_exceptions())
+
+# Exponential backoff with full jitter; a Retry-After header (in seconds) sets the minimum
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(RETRY_MAX_DELAY, float(retry_after)))
+    return delay
+
+async def retry(call: Callable[[], Awaitable[T]], attempts: Optional[int] = None) -> T:
+    attempts = attempts or _retry_attempts
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            response = getattr(e, "response", None)
+            retry_after = response.headers.get("retry-after") if isinstance(response, httpx.Response) else None
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
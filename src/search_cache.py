@@ -0,0 +1,158 @@
+import os
+import re
+import time
+import asyncio
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Tuple
+import telemetry
+
+# In-process cache for Google Custom Search results, with single-flight for identical queries
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 6 * 3600))
+SEARCH_CACHE_TTL_TIME_SENSITIVE = int(os.getenv("SEARCH_CACHE_TTL_TIME_SENSITIVE", 300))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 2048))
+
+# Queries whose answer moves quickly get the short TTL (English and Vietnamese). \b is Unicode aware,
+# so "giá" does not match inside "giám đốc".
+TIME_SENSITIVE = re.compile(
+    r'\b(today|tonight|now|current|currently|latest|live|breaking|news|price|prices|rate|rates|'
+    r'score|scores|weather|forecast|stock|stocks|yesterday|tomorrow|this week|this month|'
+    r'hôm nay|bây giờ|hiện tại|mới nhất|tin tức|giá|tỷ giá|thời tiết|trực tiếp|tối nay)\b',
+    re.IGNORECASE,
+)
+WHITESPACE = re.compile(r'\s+')
+IGNORED_PARAMS = {"key", "cx"}
+
+CacheKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+def normalize_query(query: str) -> str:
+    return WHITESPACE.sub(' ', unicodedata.normalize("NFC", query)).strip().casefold()
+
+def make_key(query: str, lan: str, params: dict) -> CacheKey:
+    extra = tuple(sorted((name, str(value)) for name, value in params.items() if name not in IGNORED_PARAMS))
+    return normalize_query(query), lan.strip().lower(), extra
+
+def is_time_sensitive(query: str) -> bool:
+    return TIME_SENSITIVE.search(normalize_query(query)) is not None
+
+class SearchCache:
+    def __init__(self, ttl: int = SEARCH_CACHE_TTL, time_sensitive_ttl: int = SEARCH_CACHE_TTL_TIME_SENSITIVE,
+                 max_entries: int = SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.time_sensitive_ttl = time_sensitive_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, Tuple[float, List[dict]]]" = OrderedDict()
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._counters = {"api_calls": 0, "hits": 0, "coalesced": 0, "errors": 0}
+        self._api_seconds = 0.0
+        self._quota_day = None
+        self._calls_today = 0
+
+    def ttl_for(self, query: str) -> int:
+        return self.time_sensitive_ttl if is_time_sensitive(query) else self.ttl
+
+    def _lookup(self, key: CacheKey):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, items = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return items
+
+    def _store(self, key: CacheKey, items: List[dict], ttl: int):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, items)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count_call(self, seconds: float, failed: bool):
+        today = datetime.now(timezone.utc).date()
+        with self._lock:
+            if today != self._quota_day:
+                self._quota_day = today
+                self._calls_today = 0
+            self._calls_today += 1
+            self._counters["api_calls"] += 1
+            self._api_seconds += seconds
+            if failed:
+                self._counters["errors"] += 1
+
+    async def get_or_fetch(self, query: str, lan: str, params: dict,
+                           fetch: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        key = make_key(query, lan, params)
+        items = self._lookup(key)
+        telemetry.cache_lookup("search", hit=items is not None)
+        if items is not None:
+            return items
+
+        # Identical queries already on their way to the API wait for that call instead of issuing another.
+        # If the caller leading that call is cancelled, a waiting caller takes over as the new leader.
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                inflight = self._inflight.get(key)
+                if inflight is None or inflight.get_loop() is not loop:
+                    future = self._inflight[key] = loop.create_future()
+                    break
+                self._counters["coalesced"] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                with self._lock:
+                    self._counters["coalesced"] -= 1
+
+        start = time.perf_counter()
+        try:
+            items = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self._count_call(time.perf_counter() - start, failed=True)
+            future.set_exception(e)
+            # Retrieve the exception so that an unawaited future does not log a warning
+            future.exception()
+            raise
+        else:
+            self._count_call(time.perf_counter() - start, failed=False)
+            self._store(key, items, self.ttl_for(query))
+            future.set_result(items)
+            return items
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["saved_calls"] = stats["hits"] + stats["coalesced"]
+            stats["calls_today"] = self._calls_today
+            stats["entries"] = len(self._entries)
+            successful = stats["api_calls"] - stats["errors"]
+            average = self._api_seconds / stats["api_calls"] if stats["api_calls"] else 0.0
+            stats["avg_api_seconds"] = average
+            stats["latency_saved_seconds"] = average * stats["saved_calls"]
+            lookups = successful + stats["saved_calls"]
+            stats["hit_rate"] = stats["saved_calls"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_search_cache = SearchCache()
+
+def get_search_cache() -> SearchCache:
+    return _search_cache
@@ -0,0 +1,84 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional
+from cache_registry import get_cache_registry
+from history import ChatHistory
+
+# Per-browser-session chat state for the Gradio apps
+SESSION_MAX = int(os.getenv("SESSION_MAX", 256))
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 15 * 60))
+CONCURRENCY_LIMIT = int(os.getenv("CONCURRENCY_LIMIT", 32))
+
+class ChatSession:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.cache = None
+        self.history = ChatHistory()
+        self.last_used = time.monotonic()
+        # One turn at a time per session; different sessions run concurrently
+        self.lock = asyncio.Lock()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    # Forget the conversation and hand back its cache handle so the caller can release it
+    def reset(self):
+        cache = self.cache
+        self.cache = None
+        self.history = ChatHistory()
+        return cache
+
+# Releasing may delete the Gemini cache, which is a network call, so keep it off the request path
+def release_cache(cache):
+    if cache is not None:
+        threading.Thread(target=get_cache_registry().release, args=(cache,), daemon=True).start()
+
+class SessionManager:
+    def __init__(self, max_sessions: int = SESSION_MAX, idle_timeout: int = SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: Optional[str]) -> ChatSession:
+        session_id = session_id or "default"
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ChatSession(session_id)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.touch()
+            self._evict()
+            return session
+
+    # Sessions are kept in last-used order: drop idle ones, then the least recently used over the bound.
+    # A session in the middle of a turn is never evicted.
+    def _evict(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for session_id, session in list(self._sessions.items()):
+            over_limit = len(self._sessions) > self.max_sessions
+            if not over_limit and session.last_used > deadline:
+                break
+            if session.lock.locked():
+                continue
+            del self._sessions[session_id]
+            release_cache(session.reset())
+
+    def drop(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            release_cache(session.reset())
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                release_cache(session.reset())
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from typing import Optional
+
+# Per-stage timing and pipeline metrics. Disabled by default; when disabled every call returns
+# after a single flag check and span() hands out one shared no-op object.
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "0") == "1"
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH")
+PROMETHEUS_PORT = int(os.getenv("PROMETHEUS_PORT", 0))
+NAMESPACE = "googlesearchllm"
+
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 1e6)
+
+# name: (kind, description, label names, buckets)
+METRICS = {
+    "stage_seconds": ("histogram", "Time spent in each pipeline stage", ("stage",), None),
+    "stage_errors_total": ("counter", "Pipeline stages that raised", ("stage",), None),
+    "fetch_bytes": ("histogram", "Bytes downloaded per fetched page", (), SIZE_BUCKETS),
+    "fetch_responses_total": ("counter", "Page fetches by outcome", ("outcome",), None),
+    "context_chars": ("histogram", "Characters of context sent to Gemini", (), SIZE_BUCKETS),
+    "context_tokens": ("histogram", "Estimated tokens of context sent to Gemini", (), TOKEN_BUCKETS),
+    "dedup_removed_chars": ("histogram", "Characters removed as near-duplicates per search", (), SIZE_BUCKETS),
+    "history_tokens": ("histogram", "Estimated tokens of conversation history per prompt", (), TOKEN_BUCKETS),
+    "gemini_tokens_total": ("counter", "Tokens reported by Gemini usage metadata", ("kind",), None),
+    "cache_lookups_total": ("counter", "Cache lookups by cache layer and result", ("cache", "result"), None),
+}
+
+_enabled = TELEMETRY_ENABLED
+_metrics = {}
+_metrics_lock = threading.Lock()
+_trace_file = None
+_trace_lock = threading.Lock()
+_server_started = False
+# prometheus_client is imported on first use, so that disabled telemetry costs nothing at startup
+_prometheus_client = False
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span_id = contextvars.ContextVar("span_id", default=None)
+
+def _prometheus():
+    global _prometheus_client
+    if _prometheus_client is False:
+        try:
+            import prometheus_client
+        except ImportError:
+            prometheus_client = None
+        _prometheus_client = prometheus_client
+    return _prometheus_client
+
+def enabled() -> bool:
+    return _enabled
+
+def configure(enabled: Optional[bool] = None, trace_log_path: Optional[str] = None, prometheus_port: Optional[int] = None):
+    global _enabled, _trace_file, _server_started
+    if enabled is not None:
+        _enabled = enabled
+    trace_log_path = trace_log_path or TRACE_LOG_PATH
+    if _enabled and trace_log_path and _trace_file is None:
+        _trace_file = open(trace_log_path, "a", buffering=1, encoding="utf-8")
+    prometheus_port = prometheus_port or PROMETHEUS_PORT
+    if _enabled and prometheus_port and not _server_started:
+        prometheus_client = _prometheus()
+        if prometheus_client is None:
+            print("prometheus_client is not installed; Prometheus export is disabled")
+        else:
+            prometheus_client.start_http_server(prometheus_port)
+            _server_started = True
+
+def _metric(name: str):
+    metric = _metrics.get(name)
+    if metric is None and _prometheus() is not None:
+        with _metrics_lock:
+            metric = _metrics.get(name)
+            if metric is None:
+                kind, description, labels, buckets = METRICS[name]
+                if kind == "counter":
+                    metric = _prometheus_client.Counter(f"{NAMESPACE}_{name}", description, labels)
+                else:
+                    kwargs = {"buckets": buckets} if buckets else {}
+                    metric = _prometheus_client.Histogram(f"{NAMESPACE}_{name}", description, labels, **kwargs)
+                _metrics[name] = metric
+    return metric
+
+def count(name: str, amount: float = 1, **labels):
+    if not _enabled:
+        return
+    metric = _metric(name)
+    if metric is not None:
+        (metric.labels(**labels) if labels else metric).inc(amount)
+
+def observe(name: str, value: float, **labels):
+    if not _enabled:
+        return
+    metric = _metric(name)
+    if metric is not None:
+        (metric.labels(**labels) if labels else metric).observe(value)
+
+def _write_trace(record: dict):
+    if _trace_file is None:
+        return
+    line = json.dumps(record, default=str, ensure_ascii=False)
+    with _trace_lock:
+        _trace_file.write(line + "\n")
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    __slots__ = ("name", "attrs", "span_id", "trace_id", "parent_id", "start", "wall", "_tokens")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = _span_id.get()
+        self.trace_id = _trace_id.get() or uuid.uuid4().hex
+        self._tokens = (_trace_id.set(self.trace_id), _span_id.set(self.span_id))
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        try:
+            _span_id.reset(self._tokens[1])
+            _trace_id.reset(self._tokens[0])
+        except ValueError:
+            # Exited from another context (e.g. an async generator resumed by a different task)
+            pass
+        observe("stage_seconds", duration, stage=self.name)
+        if exc_type is not None:
+            count("stage_errors_total", stage=self.name)
+        _write_trace({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.wall,
+            "duration": duration,
+            "error": exc_type.__name__ if exc_type is not None else None,
+            **self.attrs,
+        })
+        return False
+
+def span(name: str, **attrs):
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+def cache_lookup(cache: str, hit: bool):
+    count("cache_lookups_total", cache=cache, result="hit" if hit else "miss")
+
+# Prompt, cached and output token counts from a Gemini response's usage_metadata
+def record_usage(usage, current_span=None):
+    if not _enabled or usage is None:
+        return
+    tokens = {
+        "prompt": getattr(usage, "prompt_token_count", 0) or 0,
+        "cached": getattr(usage, "cached_content_token_count", 0) or 0,
+        "output": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+    for kind, value in tokens.items():
+        count("gemini_tokens_total", value, kind=kind)
+    if current_span is not None:
+        current_span.set(**{f"{kind}_tokens": value for kind, value in tokens.items()})
+
+def metrics_text() -> bytes:
+    prometheus_client = _prometheus()
+    if prometheus_client is None:
+        return b""
+    return prometheus_client.generate_latest()
+
+configure()
@@ -1,98 +1,457 @@
 from dotenv import load_dotenv
 import os
+import math
+import time
+import itertools
+import asyncio
+import threading
+import weakref
+import contextlib
 import httpx
-from langchain_community.document_loaders import WebBaseLoader
-from bs4 import BeautifulSoup
-import bs4
-import requests
 from langchain.docstore.document import Document
-import re
-from typing import List
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from page_cache import CachedPage, get_page_cache, ttl_from_headers
+from search_cache import get_search_cache
+from host_scores import TIER_POOR, get_host_scoreboard, host_failed
+from extract import extract_pages, normalize_text
+from dedup import deduplicate
+from passage_index import get_passage_index, index_documents
+import rate_limit
+import telemetry
 
 dotenv_path = os.path.join(os.path.dirname(__file__), "../.env")
 load_dotenv(dotenv_path)
 API_KEY = os.getenv("GOOGLE_API_KEY")
 SEARCH_KEY = os.getenv("SEARCH_KEY")
 
-# Helper function for preprocessing documents
-def preprocess_documents(documents: List[Document]) -> List[Document]:
-    processed_docs = []
-    for doc in documents:
-        # Remove excessive whitespace and newlines
-        text = re.sub(r'\s+', ' ', doc.page_content).strip()
-
-        # Remove any remaining script or style tags if they were not already removed
-        text = re.sub(r'<script.*?</script>', '', text, flags=re.DOTALL)
-        text = re.sub(r'<style.*?</style>', '', text, flags=re.DOTALL)
-
-        # Remove any leftover special characters and whitespace
-        text = re.sub(r'[^\w\s.,?!()/;-]', '', text)
-        text = re.sub(r'\s+', ' ', text).strip()
-
-        # Preserve the metadata (source, title, etc.)
-        processed_doc = Document(page_content=text, metadata=doc.metadata)
-        processed_docs.append(processed_doc)
-
-    return processed_docs
-
-# Main function to search, extract URLs, and load documents
-def search_google(query: str, topk: int = 3, lan: str = 'en', **params):
-    # Perform Google search
-    base_url = 'https://www.googleapis.com/customsearch/v1'
-    params = {
-        'key': API_KEY,
-        'cx': SEARCH_KEY,
-        'q': query,
-        'hl': lan,
-        **params
-    }
-    response = httpx.get(base_url, params=params)
-    response.raise_for_status()
-    items = response.json().get('items', [])
-    urls = [item['link'] for item in items]
-
-    # Validate the URLs:
-    unique_urls=set()
-    search_urls=[]
-    
-    for url in urls:
-        if url.split("/")[2] not in unique_urls:
-            try:
-                response = requests.get(url, timeout=1) 
-                status_code = response.status_code
-                
-            except requests.exceptions.RequestException as e:              
-                status_code = None
-                
-            if status_code == 200:
-                unique_urls.add(url.split("/")[2])
-                print(f"Currently searching the website: {url}")
-                search_urls.append(url) 
-                
-            if len(unique_urls) >= topk:
-                break
-    
-    if search_urls:
-        # Load documents from the URLs
-        loader = WebBaseLoader(
-            web_paths=search_urls,  # Limit to top 3 URLs
-            bs_kwargs=dict(parse_only=bs4.SoupStrainer()),
-            requests_kwargs={"timeout": 600}
+CSE_URL = 'https://www.googleapis.com/customsearch/v1'
+
+# Fetch engine settings: one pooled HTTP/2 client per event loop
+FETCH_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+MAX_CONNECTIONS_PER_HOST = 2
+KEEPALIVE_EXPIRY = 30.0
+FETCH_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+# Ingestion limits: bodies are streamed and reading stops at MAX_PAGE_BYTES (after decompression);
+# PDFs, images and other content types are turned away from the headers, before the body is read
+MAX_PAGE_BYTES = int(os.getenv("MAX_PAGE_BYTES", 2 * 1024 * 1024))
+STREAM_CHUNK_BYTES = 64 * 1024
+SUPPORTED_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+# Candidate selection: one wall-clock deadline for search plus downloads, further result pages only
+# when the first one cannot fill topk, and hosts the scoreboard rates poorly held back until the
+# healthy ones cannot fill it either
+RETRIEVAL_DEADLINE = float(os.getenv("RETRIEVAL_DEADLINE", 8.0))
+OVERFETCH_FACTOR = float(os.getenv("OVERFETCH_FACTOR", 1.5))
+HEDGE_SECONDS = 1.0
+# Downloads always get this long after the search results arrive, even past the deadline
+MIN_FETCH_SECONDS = 2.0
+CSE_PAGE_SIZE = 10
+CSE_MAX_PAGES = 3
+# Later results from a host that is already a candidate are only used as a fallback
+TIER_DUPLICATE_HOST = TIER_POOR + 1
+
+@dataclass
+class FetchedPage:
+    url: str
+    rank: int
+    body: bytes = b""
+    encoding: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    ttl: Optional[int] = None
+    cached: Optional[CachedPage] = None
+
+@dataclass
+class HostSlot:
+    semaphore: asyncio.Semaphore
+    users: int = 0
+
+@dataclass
+class Candidate:
+    url: str
+    rank: int
+    tier: int
+
+def get_host(url: str) -> str:
+    return urlsplit(url).netloc
+
+# A missing Content-Type is let through, the parser copes with whatever it is
+def supported_content_type(headers) -> bool:
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return not content_type or content_type in SUPPORTED_CONTENT_TYPES
+
+# Order search results for fetching: skipped hosts are dropped, poor hosts and repeated hosts go last
+async def rank_candidates(urls: List[str], first_rank: int = 0, seen_hosts: Optional[set] = None) -> List[Candidate]:
+    seen_hosts = set() if seen_hosts is None else seen_hosts
+    scoreboard = get_host_scoreboard()
+    hosts = [get_host(url) for url in urls]
+    scores = await asyncio.to_thread(scoreboard.get, hosts) if scoreboard is not None else {}
+    candidates = []
+    for rank, url in enumerate(urls, first_rank):
+        host = get_host(url)
+        stats = scores.get(host)
+        if stats is not None and stats.skipped:
+            continue
+        if host in seen_hosts:
+            tier = TIER_DUPLICATE_HOST
+        else:
+            tier = stats.tier if stats is not None else 0
+            seen_hosts.add(host)
+        candidates.append(Candidate(url, rank, tier))
+    return candidates
+
+class FetchEngine:
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            http2=True,
+            timeout=FETCH_TIMEOUT,
+            headers=FETCH_HEADERS,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
         )
-        docs = loader.load()
-        return preprocess_documents(docs)
-
-        # # Create a formatted string of document data
-        # doc_string = "\n\n".join(
-        #     f"URL {index + 1}\n"
-        #     f"Source: {doc.metadata.get('source', 'N/A')}\n"
-        #     f"Title: {doc.metadata.get('title', 'N/A')}\n"
-        #     f"Description: {doc.metadata.get('description', 'N/A')}\n"
-        #     f"Content: {doc.page_content}\n"
-        #     for index, doc in enumerate(docs)
-        # )
-
-        # return doc_string
+        self._host_slots: Dict[str, HostSlot] = {}
+
+    async def fetch(self, url: str, rank: int) -> Optional[FetchedPage]:
+        # Fresh cache entries skip the network, stale ones are revalidated with their validators.
+        # SQLite may wait on another worker's write lock, so it is never called from the event loop.
+        cache = get_page_cache()
+        cached = await asyncio.to_thread(cache.get, url) if cache is not None else None
+        if cached is not None and cached.fresh:
+            cache.record_hit()
+            telemetry.cache_lookup("page", hit=True)
+            return FetchedPage(url=url, rank=rank, cached=cached)
+        headers = cached.validators if cached is not None else {}
+
+        host = get_host(url)
+        scoreboard = get_host_scoreboard()
+        async with self._host_slot(host):
+            with telemetry.span("fetch", url=url) as fetch_span:
+                started = time.perf_counter()
+                try:
+                    response, body = await self._get(url, headers)
+                except asyncio.CancelledError:
+                    # Cut off by the deadline or because enough pages arrived: not a failure of the host,
+                    # but the time it had taken so far is a lower bound on its latency
+                    if scoreboard is not None:
+                        scoreboard.record_latency(host, time.perf_counter() - started)
+                    raise
+                if response is None:
+                    fetch_span.set(error_type="HTTPError")
+                else:
+                    fetch_span.set(status=response.status_code, bytes=len(body), truncated=len(body) >= MAX_PAGE_BYTES)
+        unsupported = response is not None and response.status_code == 200 and not supported_content_type(response.headers)
+        if scoreboard is not None:
+            failed = host_failed(response.status_code if response is not None else None)
+            scoreboard.record_fetch(host, time.perf_counter() - started, not failed)
+        if telemetry.enabled():
+            outcome = "error" if response is None else "unsupported" if unsupported else str(response.status_code)
+            telemetry.count("fetch_responses_total", outcome=outcome)
+            if response is not None:
+                telemetry.observe("fetch_bytes", len(body))
+
+        if response is not None and response.status_code == 304 and cached is not None:
+            cache.record_hit()
+            cache.record_revalidated()
+            telemetry.cache_lookup("page", hit=True)
+            await asyncio.to_thread(cache.refresh, url, ttl_from_headers(response.headers))
+            return FetchedPage(url=url, rank=rank, cached=cached)
+        if cache is not None:
+            cache.record_miss()
+            telemetry.cache_lookup("page", hit=False)
+        if response is None or response.status_code != 200 or unsupported:
+            return None
+        return FetchedPage(
+            url=url,
+            rank=rank,
+            body=body,
+            encoding=response.charset_encoding,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            ttl=ttl_from_headers(response.headers),
+        )
+
+    # At most MAX_CONNECTIONS_PER_HOST fetches per host; a host's slot is dropped once nobody uses or waits
+    # for it, so a long-running worker does not keep one for every host it ever fetched from
+    @contextlib.asynccontextmanager
+    async def _host_slot(self, host: str):
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = HostSlot(asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST))
+        slot.users += 1
+        try:
+            async with slot.semaphore:
+                yield
+        finally:
+            slot.users -= 1
+            if slot.users == 0:
+                del self._host_slots[host]
+
+    # Streamed GET: only a 200 with a supported content type has its body read, in chunks, up to
+    # MAX_PAGE_BYTES; the rest of a longer body is never downloaded
+    async def _download(self, url: str, headers: dict) -> Tuple[httpx.Response, bytes]:
+        async with self.client.stream("GET", url, headers=headers) as response:
+            if response.status_code != 200 or not supported_content_type(response.headers):
+                return response, b""
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_BYTES):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= MAX_PAGE_BYTES:
+                    break
+        body = b"".join(chunks)
+        return response, body[:MAX_PAGE_BYTES] if size > MAX_PAGE_BYTES else body
+
+    # Rate limited download; 429/5xx responses and transport errors are retried when retries are configured
+    async def _get(self, url: str, headers: dict) -> Tuple[Optional[httpx.Response], bytes]:
+        attempts = rate_limit.retry_attempts()
+        for attempt in range(attempts):
+            await rate_limit.acquire("fetch")
+            try:
+                response, body = await self._download(url, headers)
+            except httpx.HTTPError:
+                response, body = None, b""
+            else:
+                if response.status_code not in rate_limit.RETRY_STATUSES:
+                    return response, body
+            if attempt < attempts - 1:
+                retry_after = response.headers.get("retry-after") if response is not None else None
+                await asyncio.sleep(rate_limit.backoff_delay(attempt, retry_after))
+        return response, body
+
+    # Healthy candidates are fetched at once and the first successful page per host is kept. Poor hosts
+    # start after HEDGE_SECONDS or as soon as the healthy ones can no longer fill topk. Once the hosts
+    # still in play cannot fill topk either, `search_more` is called with the shortfall, once, and the
+    # candidates it returns join as they arrive. Nothing is awaited past the deadline.
+    async def fetch_candidates(self, candidates: List[Candidate], topk: int, deadline: Optional[float] = None,
+                               search_more: Optional[Callable[[int], Awaitable[List[Candidate]]]] = None
+                               ) -> List[FetchedPage]:
+        loop = asyncio.get_running_loop()
+        hedge_at = loop.time() + HEDGE_SECONDS
+        waiting = sorted(candidates, key=lambda candidate: (candidate.tier, candidate.rank))
+        running = {}
+        unique_hosts = set()
+        pages = []
+        more = None
+
+        def launch():
+            hedged = loop.time() >= hedge_at
+            while waiting:
+                candidate = waiting[0]
+                if candidate.tier > 0 and not hedged and len(pages) + len(running) >= topk:
+                    break
+                waiting.pop(0)
+                if get_host(candidate.url) not in unique_hosts:
+                    running[asyncio.ensure_future(self.fetch(candidate.url, candidate.rank))] = candidate
+
+        # Pages kept plus the other hosts that may still deliver one
+        def hosts_in_play() -> int:
+            hosts = {get_host(candidate.url) for candidate in itertools.chain(waiting, running.values())}
+            return len(pages) + len(hosts - unique_hosts)
+
+        try:
+            while len(pages) < topk:
+                launch()
+                missing = topk - hosts_in_play()
+                if search_more is not None and missing > 0:
+                    more = asyncio.ensure_future(search_more(missing))
+                    search_more = None
+                awaited = set(running) | ({more} if more is not None else set())
+                if not awaited:
+                    break
+                timeout = None if deadline is None else deadline - loop.time()
+                if timeout is not None and timeout <= 0:
+                    break
+                if waiting and loop.time() < hedge_at:
+                    hedge_wait = hedge_at - loop.time()
+                    timeout = hedge_wait if timeout is None else min(timeout, hedge_wait)
+                done, _ = await asyncio.wait(awaited, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is more:
+                        more = None
+                        if not task.cancelled() and task.exception() is None:
+                            waiting.extend(task.result())
+                            waiting.sort(key=lambda candidate: (candidate.tier, candidate.rank))
+                        continue
+                    del running[task]
+                    page = task.result()
+                    if page is None or len(pages) >= topk:
+                        continue
+                    host = get_host(page.url)
+                    if host in unique_hosts:
+                        continue
+                    unique_hosts.add(host)
+                    print(f"Currently searching the website: {page.url}")
+                    pages.append(page)
+        finally:
+            for task in running:
+                task.cancel()
+            if more is not None:
+                more.cancel()
+        return sorted(pages, key=lambda page: page.rank)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+_engines = weakref.WeakKeyDictionary()
+
+def get_fetch_engine() -> FetchEngine:
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+    if engine is None or engine.client.is_closed:
+        engine = FetchEngine()
+        _engines[loop] = engine
+    return engine
+
+# The sync API runs on one long-lived loop so the connection pool survives between calls
+_loop = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="websearch-loop", daemon=True).start()
+    return _loop
+
+def run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+# Parse only the pages that were downloaded; cached pages reuse their stored text
+def load_pages(pages: List[FetchedPage]) -> List[Document]:
+    downloaded = [page for page in pages if page.cached is None]
+    with telemetry.span("parse", pages=len(downloaded), cached=len(pages) - len(downloaded)):
+        parsed = dict(zip(
+            (page.url for page in downloaded),
+            extract_pages([(page.url, page.body, page.encoding) for page in downloaded]),
+        ))
+
+    cache = get_page_cache()
+    scoreboard = get_host_scoreboard()
+    docs = []
+    for page in pages:
+        if page.cached is not None:
+            docs.append(Document(page_content=page.cached.text, metadata=page.cached.metadata))
+            continue
+        doc = parsed[page.url]
+        if scoreboard is not None:
+            scoreboard.record_yield(get_host(page.url), len(doc.page_content))
+        if cache is not None and page.ttl is not None:
+            cache.put(page.url, doc.page_content, doc.metadata, page.etag, page.last_modified, page.ttl)
+        docs.append(doc)
+    return docs
+
+# Helper function for preprocessing documents that did not come through the extraction engine
+def preprocess_documents(documents: List[Document]) -> List[Document]:
+    return [Document(page_content=normalize_text(doc.page_content), metadata=doc.metadata) for doc in documents]
+
+# Google Custom Search through the result cache, on the pooled client
+async def search_items(query: str, lan: str = 'en', **params) -> List[dict]:
+    engine = get_fetch_engine()
+
+    async def call_api():
+        await rate_limit.acquire("cse")
+        with telemetry.span("cse", query=query):
+            response = await engine.client.get(CSE_URL, params={
+                'key': API_KEY,
+                'cx': SEARCH_KEY,
+                'q': query,
+                'hl': lan,
+                **params
+            })
+            response.raise_for_status()
+            return response.json().get('items', [])
+
+    return await get_search_cache().get_or_fetch(query, lan, params, lambda: rate_limit.retry(call_api))
+
+# Further Custom Search result pages, enough for OVERFETCH_FACTOR times the missing hosts and requested
+# together; a failed page only loses its own results
+async def search_more_candidates(query: str, lan: str, missing: int, seen_hosts: set, **params) -> List[Candidate]:
+    pages = min(CSE_MAX_PAGES - 1, math.ceil(missing * OVERFETCH_FACTOR / CSE_PAGE_SIZE))
+    starts = [1 + CSE_PAGE_SIZE * page for page in range(1, pages + 1)]
+    results = await asyncio.gather(
+        *(search_items(query, lan, start=start, **params) for start in starts), return_exceptions=True
+    )
+    candidates = []
+    for start, items in zip(starts, results):
+        if isinstance(items, BaseException):
+            continue
+        candidates += await rank_candidates([item['link'] for item in items], start - 1, seen_hosts)
+    return candidates
+
+# Main function to search, fetch the top websites concurrently, and load documents.
+# Queries the local passage index covers well are answered from it; searches with extra Custom Search
+# parameters always go live.
+async def search_google_async(query: str, topk: int = 3, lan: str = 'en',
+                              deadline: Optional[float] = RETRIEVAL_DEADLINE, use_index: bool = True,
+                              **params) -> List[Document]:
+    engine = get_fetch_engine()
+    loop = asyncio.get_running_loop()
+    deadline_at = loop.time() + deadline if deadline else None
+    with telemetry.span("search_google", query=query, topk=topk) as search_span:
+        index = get_passage_index() if use_index and not params else None
+        if index is not None:
+            docs = await asyncio.to_thread(index.lookup, query, topk, lan)
+            search_span.set(from_index=docs is not None)
+            if docs is not None:
+                print(f"Answered from the local index: {len(docs)} pages")
+                return docs
+
+        # Perform Google search, within the deadline; a search that used most of it still leaves the
+        # downloads MIN_FETCH_SECONDS
+        try:
+            timeout = None if deadline_at is None else max(deadline_at - loop.time(), 0)
+            items = await asyncio.wait_for(search_items(query, lan, **params), timeout)
+        except asyncio.TimeoutError:
+            print(f"Google search did not answer within {deadline} seconds")
+            search_span.set(error_type="TimeoutError")
+            return []
+        if deadline_at is not None:
+            deadline_at = max(deadline_at, loop.time() + MIN_FETCH_SECONDS)
+        seen_hosts = set()
+        candidates = await rank_candidates([item['link'] for item in items], 0, seen_hosts)
+
+        # Further result pages cost quota: they are only requested, in parallel with the downloads, when
+        # too few hosts survive the first page or when failed fetches leave too few
+        searched_more = False
+        async def search_more(missing: int) -> List[Candidate]:
+            nonlocal searched_more
+            searched_more = True
+            return await search_more_candidates(query, lan, missing, seen_hosts, **params)
+        can_search_more = len(items) >= CSE_PAGE_SIZE and 'start' not in params
+
+        # Download the candidates in a single pass, one website per host
+        with telemetry.span("fetch_candidates", candidates=len(candidates)) as fetch_span:
+            pages = await engine.fetch_candidates(candidates, topk, deadline_at, search_more if can_search_more else None)
+            fetch_span.set(fetched=len(pages), extra_pages=searched_more)
+        if not pages:
+            return []
+
+        # Parsing and deduplication are CPU-bound, keep them off the event loop
+        docs, report = await asyncio.to_thread(lambda: deduplicate(load_pages(pages)))
+        if report.removed_chars:
+            print(f"Deduplication: removed {report.removed_chars} characters "
+                  f"({report.removed_documents} duplicate pages, {report.removed_passages} repeated passages)")
+        index_documents(docs, lan)
+        return docs
+
+def search_google(query: str, topk: int = 3, lan: str = 'en', **params) -> List[Document]:
+    return run_sync(search_google_async(query, topk, lan, **params))
 
 if __name__ == "__main__":
     search_google('bitcoin price today', 10)